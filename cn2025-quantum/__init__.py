@@ -1,4 +1,4 @@
-__all__ = ["graph_builder", "network_generator", "metrics"]
+__all__ = ["graph_builder", "network_generator", "metrics", "routing_view", "fidelity", "experiment", "benchmark", "topology_pool", "compact_topology", "instrumentation", "qos_search", "dynamic_routing", "result_store", "path_cache", "table_cache", "forwarding"]
 
 __version__="0.3"
 def __dir__():
@@ -1,17 +1,88 @@
+import argparse
+from contextlib import nullcontext
 from graph_builder import *
 from network_generator import *
 from metrics import *
+from experiment import GENERATORS, run_experiment, run_batched
+from topology_pool import FIXED_STRUCTURE_GENERATORS
+from result_store import ResultStore
+import instrumentation
 
-higher_better=0
-lower_better=0
-for i in range(1,101):
-    nw1=dict_to_topo(regular_gen(6, frac=0.5))
-    set_parameters(nw1)
-    set_efficiency_xi(nw1, 0.9)
-    mean_hp, stddev_hp, mean_lp, stddev_lp = evaluate_kx0shortest_path_qos(nw1)
-    if mean_hp > mean_lp:
-        higher_better+=1
-    else:
-        lower_better+=1
 
-print(higher_better, lower_better)
+def parse_args():
+    parser = argparse.ArgumentParser(description="Monte-Carlo comparison of high and low priority destinations.")
+    parser.add_argument("--trials", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, 1 runs serially (default: one per CPU)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--generator", choices=sorted(GENERATORS), default="regular")
+    parser.add_argument("--strategy", nargs="+", choices=sorted(STRATEGIES), default=["kx0shortest_path_qos"],
+                        help="one or more strategies, compared on the same trials")
+    parser.add_argument("-n", type=int, default=6)
+    parser.add_argument("--frac", type=float, default=0.5)
+    parser.add_argument("--xi", type=float, default=0.9)
+    parser.add_argument("--alpha", type=float, default=None, help="draw efficiencies with set_efficiency_alpha instead of xi")
+    parser.add_argument("--reuse-topologies", action="store_true", help="build each structure once per worker (TopologyPool; regular generator only)")
+    parser.add_argument("--path-cache", action="store_true", help="enumerate candidate paths once per structure and reuse them across trials")
+    parser.add_argument("--path-spill", metavar="PATH", default=None, help="back the path cache with a SQLite file (implies --path-cache)")
+    parser.add_argument("--table-cache", metavar="PATH", default=None, help="reuse forwarding tables stored in a SQLite file by earlier runs of the same draws")
+    parser.add_argument("--analytic", action="store_true", help="route and score on array topologies without building SeQUeNCe objects")
+    parser.add_argument("--batched", action="store_true",
+                        help="score all trials in a few array operations on one structure, always on array topologies "
+                             "(regular generator, not efficiency_cost; no --store, --workers, --reuse-topologies or --table-cache)")
+    parser.add_argument("--store", metavar="PATH", default=None,
+                        help="record trials in a SQLite result store and skip those it already holds (needs --seed to resume)")
+    parser.add_argument("--verbose", action="store_true", help="print every trial as it finishes")
+    parser.add_argument("--instrument", action="store_true", help="print hot-path counters and timings (runs serially)")
+    parser.add_argument("--profile", metavar="PATH", default=None, help="dump cProfile stats to PATH (runs serially)")
+    args = parser.parse_args()
+    if args.batched:
+        for (flag, value) in (("--store", args.store), ("--workers", args.workers), ("--reuse-topologies", args.reuse_topologies), ("--table-cache", args.table_cache)):
+            if value:
+                parser.error(f"--batched runs in one process on one structure and does not take {flag}")
+        if args.generator not in FIXED_STRUCTURE_GENERATORS:
+            parser.error(f"--batched needs one structure for all trials, and {args.generator} draws one per trial")
+    if args.reuse_topologies and not args.analytic and args.generator not in FIXED_STRUCTURE_GENERATORS:
+        parser.error(f"--reuse-topologies would fix one {args.generator} structure for every trial")
+    unbatched = [name for name in args.strategy if args.batched and name not in BATCHED_STRATEGIES]
+    if unbatched:
+        parser.error(f"--batched cannot score {', '.join(unbatched)}")
+    return args
+
+
+def print_result(trial, seed, results):
+    for (name, result) in results.items():
+        print(trial, seed, name, *result)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    on_result = print_result if args.verbose else None
+    workers = args.workers
+    if args.instrument or args.profile:
+        # counters and profiles only see this process
+        workers = 1
+    store = ResultStore(args.store) if args.store else None
+    experiment = lambda: run_experiment(args.trials, workers, args.seed, on_result=on_result,
+                                        generator=args.generator, n=args.n, frac=args.frac,
+                                        xi=args.xi, alpha=args.alpha, strategies=args.strategy,
+                                        reuse_topologies=args.reuse_topologies, analytic=args.analytic,
+                                        path_cache=args.path_cache, path_spill=args.path_spill,
+                                        table_cache=args.table_cache, store=store)
+    if args.batched:
+        experiment = lambda: run_batched(args.trials, args.seed, generator=args.generator, n=args.n, frac=args.frac,
+                                         xi=args.xi, alpha=args.alpha, strategies=args.strategy, on_result=on_result,
+                                         path_cache=args.path_cache, path_spill=args.path_spill)
+    collector = instrumentation.Collector() if args.instrument else None
+    with collector or nullcontext(), store or nullcontext():
+        if args.profile:
+            (summaries, stats) = instrumentation.profile(args.profile, experiment)
+            stats.sort_stats("cumulative").print_stats(20)
+        else:
+            summaries = experiment()
+    if collector is not None:
+        print(collector.report())
+    for (name, summary) in summaries.items():
+        if len(summaries) == 1:
+            print(summary["higher_better"], summary["lower_better"])
+        else:
+            print(name, summary["higher_better"], summary["lower_better"])
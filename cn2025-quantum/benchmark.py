@@ -0,0 +1,268 @@
+import argparse
+import json
+import os
+import platform
+import random
+import time
+import tracemalloc
+import numpy as np
+from graph_builder import regular_gen, waxman_gen
+from network_generator import *
+from metrics import STRATEGIES, evaluate_strategy, get_source_nodes, get_dest_nodes
+from dynamic_routing import DynamicRouter, DYNAMIC_STRATEGIES, set_router_efficiency
+
+SIZES = (3, 6, 10, 15, 20, 30)
+FRACTIONS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0)
+# kept out of the working directory, and ignored by git, next to the package
+BASELINE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmark_results", "baseline.json")
+
+
+def best_time(func, repeats=5) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_dict_to_topo(sizes=(3, 6, 10), repeats=5, frac=0.5):
+    '''
+    Per-trial cost of building a RouterNetTopo through a JSON file
+    (file_to_topo, the old dict_to_topo) against the in-memory construction.
+    '''
+    rows = []
+    for n in sizes:
+        random.seed(n)
+        graph = regular_gen(n, frac=frac)
+        file_time = best_time(lambda: file_to_topo(graph), repeats)
+        memory_time = best_time(lambda: dict_to_topo(graph), repeats)
+        rows.append((n, file_time, memory_time))
+    return rows
+
+
+def _full_rebuild(topology, strategy, sources, destinations):
+    (x, qos) = DYNAMIC_STRATEGIES[strategy]
+    clear_forwarding_tables(topology)
+    if qos and x is None:
+        gen_tables_kshortest_path_qos_all(topology, sources, destinations)
+    elif qos:
+        gen_tables_kxshortest_path_qos_all(topology, sources, destinations, x=x)
+    elif x is None:
+        gen_tables_kshortest_path_all(topology, sources, destinations)
+    else:
+        gen_tables_kxshortest_path_all(topology, sources, destinations, x=x)
+
+
+def bench_incremental(n=10, strategy="kx0shortest_path_qos", fractions=FRACTIONS, repeats=3, frac=0.5, xi=0.9):
+    '''
+    DynamicRouter.update against a full rebuild (clear_forwarding_tables and
+    gen_tables_*_all) after the efficiency of a fraction of the routers is
+    flipped between 0.999 and 0.8. Returns rows of (fraction, routers
+    changed, mean pairs recomputed, mean incremental time, mean full time).
+    '''
+    random.seed(n)
+    topology = dict_to_topo(regular_gen(n, frac=frac))
+    set_parameters(topology)
+    set_efficiency_xi(topology, xi)
+    router = DynamicRouter(topology, strategy)
+    names = router.view.names
+    sources = _names(get_source_nodes(topology))
+    destinations = _names(get_dest_nodes(topology))
+    rows = []
+    for fraction in fractions:
+        changed = max(1, round(fraction*len(names)))
+        recomputed = incremental = full = 0
+        for _ in range(repeats):
+            efficiency = dict(zip(names, router.view.efficiency.tolist()))
+            set_router_efficiency(topology, {name: 0.8 if efficiency[name] > 0.9 else 0.999 for name in random.sample(names, changed)})
+            start = time.perf_counter()
+            recomputed += len(router.update())
+            incremental += time.perf_counter() - start
+            full += best_time(lambda: _full_rebuild(topology, strategy, sources, destinations), 1)
+        rows.append((fraction, changed, recomputed/repeats, incremental/repeats, full/repeats))
+    return rows
+
+
+def peak_memory(func) -> int:
+    '''
+    Peak bytes allocated by one call of func, as traced by tracemalloc.
+    '''
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _names(nodes) -> list:
+    return [node.name for node in nodes]
+
+
+def _gen_tables_stages(topology):
+    # one call per stage installs the tables of every source-destination pair
+    sources = _names(get_source_nodes(topology))
+    destinations = _names(get_dest_nodes(topology))
+    def run(gen_tables, *args, **kwargs):
+        def stage():
+            clear_forwarding_tables(topology)
+            gen_tables(topology, *args, **kwargs)
+        return stage
+    return {
+        "gen_tables_shortest_path": run(gen_tables_shortest_path),
+        "gen_tables_efficiency_cost": run(gen_tables_efficiency_cost),
+        "gen_tables_kshortest_path": run(gen_tables_kshortest_path_all, sources, destinations),
+        "gen_tables_kxshortest_path": run(gen_tables_kxshortest_path_all, sources, destinations),
+        "gen_tables_kx0shortest_path": run(gen_tables_kxshortest_path_all, sources, destinations, x=0),
+        "gen_tables_kshortest_path_qos": run(gen_tables_kshortest_path_qos_all, sources, destinations),
+        "gen_tables_kxshortest_path_qos": run(gen_tables_kxshortest_path_qos_all, sources, destinations),
+        "gen_tables_kx0shortest_path_qos": run(gen_tables_kxshortest_path_qos_all, sources, destinations, x=0),
+    }
+
+
+def stages(n: int, frac=0.5, xi=0.9) -> dict:
+    '''
+    The timed stages of one trial of size n, in pipeline order. The
+    topology the later stages work on is built here, outside the timings.
+    '''
+    random.seed(n)
+    graph = regular_gen(n, frac=frac)
+    topology = dict_to_topo(graph)
+    set_parameters(topology)
+    set_efficiency_xi(topology, xi)
+    timed = {
+        "regular_gen": lambda: regular_gen(n, frac=frac),
+        "waxman_gen": lambda: waxman_gen(n, frac=frac),
+        "dict_to_topo": lambda: dict_to_topo(graph),
+        "set_parameters": lambda: set_parameters(topology),
+        "set_efficiency_xi": lambda: set_efficiency_xi(topology, xi),
+    }
+    timed.update(_gen_tables_stages(topology))
+    for name in STRATEGIES:
+        timed["evaluate_"+name] = lambda name=name: evaluate_strategy(topology, name)
+    return timed
+
+
+def scaling_exponent(sizes, times):
+    '''
+    Least-squares slope of log(time) against log(n): time grows roughly as
+    n**exponent over the measured sizes. None with fewer than two sizes.
+    '''
+    points = [(n, t) for (n, t) in zip(sizes, times) if t > 0]
+    if len(points) < 2:
+        return None
+    (n, t) = np.log(np.array(points)).T
+    return float(np.polyfit(n, t, 1)[0])
+
+
+def run_suite(sizes=SIZES, repeats=3, frac=0.5, xi=0.9, only=None, on_stage=None) -> dict:
+    '''
+    Times every stage at every size: best wall time over repeats and the peak
+    traced memory of one further call. only restricts the run to the named
+    stages. on_stage, if given, is called with (stage, n, time, memory) as
+    each measurement finishes.
+    '''
+    results = {}
+    for n in sizes:
+        for (stage, func) in stages(n, frac, xi).items():
+            if only and stage not in only:
+                continue
+            wall = best_time(func, repeats)
+            memory = peak_memory(func)
+            entry = results.setdefault(stage, {"n": [], "time": [], "peak_memory": []})
+            entry["n"].append(n)
+            entry["time"].append(wall)
+            entry["peak_memory"].append(memory)
+            if on_stage is not None:
+                on_stage(stage, n, wall, memory)
+    for entry in results.values():
+        entry["exponent"] = scaling_exponent(entry["n"], entry["time"])
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "sizes": list(sizes),
+        "repeats": repeats,
+        "frac": frac,
+        "xi": xi,
+        "stages": results,
+    }
+
+
+def compare(current: dict, previous: dict) -> list:
+    '''
+    (stage, n, previous time, current time, ratio) for every measurement
+    present in both runs. A ratio above 1 means the current run is slower.
+    '''
+    rows = []
+    for (stage, entry) in current["stages"].items():
+        before = previous.get("stages", {}).get(stage)
+        if before is None:
+            continue
+        old_times = dict(zip(before["n"], before["time"]))
+        for (n, new_time) in zip(entry["n"], entry["time"]):
+            if n in old_times and old_times[n] > 0:
+                rows.append((stage, n, old_times[n], new_time, new_time/old_times[n]))
+    return rows
+
+
+def load_baseline(path: str):
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_baseline(path: str, suite: dict):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as file:
+        json.dump(suite, file, indent=2)
+
+
+def print_suite(suite: dict):
+    print("stage\tn\ttime (s)\tpeak memory (KiB)")
+    for (stage, entry) in suite["stages"].items():
+        for (n, wall, memory) in zip(entry["n"], entry["time"], entry["peak_memory"]):
+            print(f"{stage}\t{n}\t{wall:.4f}\t\t{memory/1024:.1f}")
+    print()
+    print("stage\tscaling exponent")
+    for (stage, entry) in suite["stages"].items():
+        exponent = entry["exponent"]
+        print(f"{stage}\t" + ("-" if exponent is None else f"{exponent:.2f}"))
+
+
+def print_comparison(rows):
+    print("stage\tn\tprevious (s)\tcurrent (s)\tratio")
+    for (stage, n, old_time, new_time, ratio) in rows:
+        print(f"{stage}\t{n}\t{old_time:.4f}\t\t{new_time:.4f}\t\t{ratio:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the trial pipeline, stage by stage.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--stages", nargs="+", default=None, help="only run these stages")
+    parser.add_argument("--baseline", default=BASELINE, help="JSON file compared against, then replaced by this run")
+    parser.add_argument("--no-save", action="store_true", help="compare against the baseline without replacing it")
+    parser.add_argument("--dict-to-topo", action="store_true", help="compare file_to_topo with dict_to_topo instead")
+    parser.add_argument("--incremental", metavar="STRATEGY", choices=sorted(DYNAMIC_STRATEGIES), default=None,
+                        help="compare DynamicRouter updates with full rebuilds instead, at the largest size")
+    args = parser.parse_args()
+    if args.incremental:
+        print("changed\trouters\tpairs\tincremental (s)\tfull (s)\tspeedup")
+        for (fraction, changed, pairs, incremental, full) in bench_incremental(max(args.sizes), args.incremental, repeats=args.repeats):
+            print(f"{fraction:.0%}\t{changed}\t{pairs:.0f}\t{incremental:.4f}\t\t{full:.4f}\t\t{full/incremental:.2f}x")
+    elif args.dict_to_topo:
+        print("n\tfile (s)\tin-memory (s)\tspeedup")
+        for (n, file_time, memory_time) in bench_dict_to_topo(args.sizes, args.repeats):
+            print(f"{n}\t{file_time:.4f}\t\t{memory_time:.4f}\t\t{file_time/memory_time:.2f}x")
+    else:
+        suite = run_suite(args.sizes, args.repeats, only=args.stages)
+        print_suite(suite)
+        previous = load_baseline(args.baseline)
+        if previous is not None:
+            print()
+            print_comparison(compare(suite, previous))
+        if not args.no_save:
+            save_baseline(args.baseline, suite)
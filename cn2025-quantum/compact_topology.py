@@ -0,0 +1,73 @@
+import numpy as np
+
+ROUTER_DEFAULTS = {
+    "type": "QuantumRouter",
+    "memo_size": 50,
+}
+QCONNECTION_DEFAULTS = {
+    "attenuation": 0.0002,
+    "type": "meet_in_the_middle",
+}
+CCONNECTION_DEFAULTS = {
+    "delay": 500000000,
+}
+TOPOLOGY_DEFAULTS = {
+    "is_parallel": False,
+    "stop_time": 2000000000000,
+}
+
+
+class CompactTopology:
+    '''
+    Array form of the topologies produced by regular_gen and waxman_gen.
+
+    Routers are integer ids 0..len(names)-1, in the order the dict form
+    lists them, and a router's id doubles as its seed. Every connection is
+    one entry of the edge arrays u, v and distance. The fields that are the
+    same for every node or connection (memo size, attenuation, delay, ...)
+    are kept once in ROUTER_DEFAULTS, QCONNECTION_DEFAULTS and
+    CCONNECTION_DEFAULTS. to_dict builds the SeQUeNCe config only when a
+    RouterNetTopo is actually needed.
+    '''
+    def __init__(self, names, u, v, distance):
+        self.names = list(names)
+        self.u = np.asarray(u, dtype=np.int32)
+        self.v = np.asarray(v, dtype=np.int32)
+        self.distance = np.asarray(distance, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.names)
+
+    def sources(self) -> list:
+        return [name for name in self.names if 's' in name]
+
+    def destinations(self) -> list:
+        return [name for name in self.names if 'd' in name]
+
+    def router_distances(self) -> np.ndarray:
+        '''
+        Router-to-router edge weights as RouterNetTopo reports them: each half
+        of a meet_in_the_middle connection is distance // 2 long.
+        '''
+        return 2*(self.distance // 2)
+
+    def to_dict(self) -> dict:
+        graph = dict(TOPOLOGY_DEFAULTS)
+        graph["nodes"] = [dict(name=name, type=ROUTER_DEFAULTS["type"], seed=seed, memo_size=ROUTER_DEFAULTS["memo_size"])
+                          for (seed, name) in enumerate(self.names)]
+        graph["qconnections"] = []
+        graph["cconnections"] = []
+        for (u, v, distance) in zip(self.u.tolist(), self.v.tolist(), self.distance.tolist()):
+            graph["qconnections"].append({
+                "node1": self.names[u],
+                "node2": self.names[v],
+                "attenuation": QCONNECTION_DEFAULTS["attenuation"],
+                "distance": distance,
+                "type": QCONNECTION_DEFAULTS["type"]
+            })
+            graph["cconnections"].append({
+                "node1": self.names[u],
+                "node2": self.names[v],
+                "delay": CCONNECTION_DEFAULTS["delay"]
+            })
+        return graph
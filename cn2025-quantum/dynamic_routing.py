@@ -0,0 +1,170 @@
+import numpy as np
+from sequence.topology.router_net_topo import RouterNetTopo
+from graph_builder import is_high
+from compact_topology import CompactTopology
+from routing_view import get_routing_view, invalidate_routing_view
+from fidelity import select_path
+from qos_search import hop_distances
+from forwarding import write_path
+from network_generator import clear_forwarding_tables, push_forwarding_tables, candidate_indices, qos_pair_path
+from metrics import PAIR_STRATEGIES
+import instrumentation
+
+# strategy name -> (x, qos) of the per-pair strategies DynamicRouter
+# maintains, the registry's own table so the two cannot disagree
+DYNAMIC_STRATEGIES = PAIR_STRATEGIES
+
+
+def set_router_efficiency(topology: RouterNetTopo, efficiencies: dict):
+    '''
+    Sets the memory efficiency of the named routers, for what-if changes
+    between DynamicRouter updates.
+    '''
+    if isinstance(topology, CompactTopology):
+        view = get_routing_view(topology)
+        view.set_node_params(efficiency=[efficiencies.get(name, e) for (name, e) in zip(view.names, view.efficiency.tolist())])
+        return
+    for node in topology.get_nodes_by_type(RouterNetTopo.QUANTUM_ROUTER):
+        if node.name in efficiencies:
+            memory_array = node.get_components_by_type("MemoryArray")[0]
+            memory_array.update_memory_params("efficiency", efficiencies[node.name])
+            instrumentation.count("get_components_by_type")
+    invalidate_routing_view(topology)
+
+
+class DynamicRouter:
+    '''
+    Keeps the forwarding tables of one k-family strategy current while node
+    parameters change, without rebuilding them from scratch.
+
+    The candidate paths of every pair depend only on the structure, so they
+    are enumerated once and kept as repeater index matrices. update() diffs
+    the fidelity factors against those of the last build and recomputes
+    only the pairs that can see a changed router: for candidate strategies,
+    a changed router inside one of the pair's candidates; for the kx QoS
+    strategies, which search every path of at most d+x hops, a changed
+    router within d+x hops of both ends. Destinations whose chosen paths
+    moved are then rewritten in pair order, so the tables always equal
+    those of a full gen_tables_*_all rebuild. They live in the view's
+    next_hops and, with push, are copied to SeQUeNCe after every change.
+    Candidates go through path_cache, a PathCache, if given.
+    '''
+    def __init__(self, topology: RouterNetTopo, strategy="kx0shortest_path_qos", sources=None, destinations=None, k=10, is_high=is_high, push=True, path_cache=None):
+        (self.x, qos) = DYNAMIC_STRATEGIES[strategy]
+        self.push = push
+        self.path_cache = path_cache
+        self.topology = topology
+        self.strategy = strategy
+        self.k = k
+        self.is_high = is_high if qos else None
+        self.view = get_routing_view(topology)
+        view = self.view
+        if sources is None:
+            sources = [name for name in view.names if 's' in name]
+        if destinations is None:
+            destinations = [name for name in view.names if 'd' in name]
+        self.pairs = [(source, destination) for source in sources for destination in destinations if source != destination]
+        self.searches = {}
+        if self.is_high is not None and self.x is not None:
+            self._init_reach(sources, destinations)
+        else:
+            self._init_candidates()
+        self.rebuild()
+
+    def _init_candidates(self):
+        view = self.view
+        self.candidates = []
+        self.matrices = []
+        users = [[] for _ in view.names]
+        distances = {}
+        for (p, (source, destination)) in enumerate(self.pairs):
+            indices = candidate_indices(view, source, destination, self.k, self.x, distances, self.path_cache)
+            instrumentation.count("candidate_paths", len(indices))
+            self.candidates.append([[view.names[i] for i in path] for path in indices])
+            self.matrices.append(view.fidelity_table.repeater_matrix(indices))
+            for router in {i for path in indices for i in path[1:-1]}:
+                users[router].append(p)
+        self.users = users
+
+    def _init_reach(self, sources, destinations):
+        # through[p][r] is the fewest hops of a walk between the ends of pair
+        # p that passes router r (inf at the ends themselves); r can only lie
+        # on one of the pair's paths if that fits the pair's hop budget
+        view = self.view
+        reach = {}
+        for name in set(sources) | set(destinations):
+            distances = np.array(hop_distances(view.adjacency, view.index[name]), dtype=float)
+            distances[distances < 0] = np.inf
+            reach[name] = distances
+        self.through = np.array([reach[source] + reach[destination] for (source, destination) in self.pairs]).reshape(len(self.pairs), len(view.names))
+        for (p, (source, destination)) in enumerate(self.pairs):
+            self.through[p, [view.index[source], view.index[destination]]] = np.inf
+        self.budgets = np.array([reach[destination][view.index[source]] + self.x for (source, destination) in self.pairs])
+
+    def _choose(self, p):
+        (source, destination) = self.pairs[p]
+        view = self.view
+        if self.is_high is not None and self.x is not None:
+            return qos_pair_path(view, source, destination, self.k, self.x, self.is_high, self.searches)
+        paths = self.candidates[p]
+        if not paths:
+            return None
+        highest = self.is_high is not None and not self.is_high(destination)
+        chosen = select_path(view.fidelity_table.score_matrix(self.matrices[p]), highest)
+        return None if chosen is None else paths[chosen]
+
+    def _affected(self, changed) -> list:
+        if self.is_high is not None and self.x is not None:
+            return np.flatnonzero((self.through[:, changed] <= self.budgets[:, None]).any(axis=1)).tolist()
+        return sorted({p for router in changed.tolist() for p in self.users[router]})
+
+    def rebuild(self):
+        '''
+        Clears the forwarding tables, recomputes every pair and writes all
+        rules again.
+        '''
+        self.view = get_routing_view(self.topology, self.view)
+        self.factors = self.view.fidelity_table.factors.copy()
+        self.searches = {}
+        self.final_paths = {pair: self._choose(p) for (p, pair) in enumerate(self.pairs)}
+        clear_forwarding_tables(self.topology)
+        self._install({destination for (_, destination) in self.pairs})
+
+    def update(self) -> list:
+        '''
+        Brings the tables up to date with the current node parameters.
+        Returns the (source, destination) pairs that were recomputed.
+        '''
+        self.view = get_routing_view(self.topology, self.view)
+        factors = self.view.fidelity_table.factors
+        changed = np.flatnonzero(factors != self.factors)
+        if len(changed) == 0:
+            return []
+        self.factors = factors.copy()
+        for search in self.searches.values():
+            # completion bounds depend on the factors, hop distances do not
+            search[1] = None
+        affected = self._affected(changed)
+        moved = set()
+        for p in affected:
+            pair = self.pairs[p]
+            path = self._choose(p)
+            if path != self.final_paths[pair]:
+                self.final_paths[pair] = path
+                moved.add(pair[1])
+        self._install(moved)
+        return [self.pairs[p] for p in affected]
+
+    def _install(self, destinations):
+        view = self.view
+        if not destinations:
+            return
+        next_hops = view.next_hops
+        next_hops.clear([view.index[destination] for destination in destinations])
+        for ((_, destination), final_path) in self.final_paths.items():
+            if final_path is None or destination not in destinations:
+                continue
+            write_path(next_hops, view.path_indices(final_path))
+            instrumentation.count("forwarding_rules", len(final_path) - 1)
+        if self.push:
+            push_forwarding_tables(self.topology, view)
@@ -0,0 +1,261 @@
+import random
+from contextlib import contextmanager, nullcontext
+from inspect import signature
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from network_generator import dict_to_topo, set_parameters, set_efficiency_xi, set_efficiency_alpha, draw_efficiencies
+from metrics import *
+from topology_pool import GENERATORS, COMPACT_GENERATORS, FIXED_STRUCTURE_GENERATORS, TopologyPool
+from path_cache import PathCache
+from table_cache import TableCache
+
+def trial_seeds(trials: int, seed=None) -> list:
+    '''
+    One independent seed per trial, derived from a single base seed.
+
+    Seeds belong to trials rather than to workers, so a run gives the same
+    per-trial results whatever the number of workers or completion order.
+    '''
+    return [int(s) for s in np.random.SeedSequence(seed).generate_state(trials)]
+
+
+# one pool per worker process, used when trials reuse topologies
+_pool = None
+# one candidate-path cache per worker process, keyed by its spill file
+_paths = None
+# one forwarding-table cache per worker process, keyed by its file
+_tables = None
+
+@contextmanager
+def open_caches(path_cache=False, path_spill=None, table_cache=None):
+    '''
+    Opens the caches that trials with these options go through for the
+    duration of a with block, and yields them as a (PathCache, TableCache)
+    pair, None where nothing is cached.
+    '''
+    paths = PathCache(spill=path_spill) if path_cache or path_spill else None
+    tables = TableCache(table_cache) if table_cache else None
+    with paths or nullcontext(), tables or nullcontext():
+        yield (paths, tables)
+
+def _process_caches(path_cache, path_spill, table_cache):
+    # this worker process's caches, reopened when a trial names another file
+    global _paths, _tables
+    paths = None
+    if path_cache or path_spill:
+        if _paths is None or _paths.spill != path_spill:
+            if _paths is not None:
+                _paths.close()
+            _paths = PathCache(spill=path_spill)
+        paths = _paths
+    tables = None
+    if table_cache:
+        if _tables is None or _tables.path != table_cache:
+            if _tables is not None:
+                _tables.close()
+            _tables = TableCache(table_cache)
+        tables = _tables
+    return (paths, tables)
+
+def run_trial(trial: int, seed: int, generator="regular", n=6, frac=0.5, xi=0.9, alpha=None, strategies=("kx0shortest_path_qos",), reuse_topologies=False, analytic=False, path_cache=False, path_spill=None, table_cache=None, caches=None):
+    '''
+    Runs one trial of every strategy on the same topology. With
+    reuse_topologies the structure comes from this process's TopologyPool
+    instead of being rebuilt. For regular_gen the random draws are the same
+    either way, and so are the results. Generators that draw a new
+    structure per trial, waxman_gen, cannot reuse one and raise ValueError.
+
+    With analytic the trial runs on the generator's CompactTopology and never
+    builds SeQUeNCe objects. Parameters are drawn into arrays in the same
+    order, so the results equal those of the RouterNetTopo path without
+    reuse_topologies, which analytic ignores.
+
+    With path_cache, candidate paths come from a PathCache, backed by the
+    SQLite file path_spill if given, so trials on the same structure
+    enumerate them once. With table_cache, the path of a TableCache file,
+    strategies whose tables it holds for the trial's exact structure and
+    parameter draws install them from there instead of routing. The
+    results do not change either way. The caches used are caches, the
+    pair open_caches yields for these options, if given, and otherwise
+    this process's own, reopened whenever a trial names other files.
+
+    Returns (trial, seed, results, stats, seconds): results maps each
+    strategy to its result tuple, stats to the (hp_stats, lp_stats)
+    RunningStats holding every high and low priority pair fidelity of the
+    trial, and seconds to its wall time.
+    '''
+    global _pool
+    random.seed(seed)
+    np.random.seed(seed)
+    label = is_high
+    if analytic:
+        topology = COMPACT_GENERATORS[generator](n, frac=frac)
+        set_parameters(topology)
+    elif reuse_topologies:
+        if generator not in FIXED_STRUCTURE_GENERATORS:
+            raise ValueError(f"{generator} draws a new structure per trial and cannot reuse topologies")
+        if _pool is None:
+            _pool = TopologyPool()
+        current = _pool.acquire(generator, n, frac)
+        topology, label = current.topology, current.is_high
+    else:
+        topology = dict_to_topo(GENERATORS[generator](n, frac=frac))
+        set_parameters(topology)
+    if alpha is None:
+        set_efficiency_xi(topology, xi)
+    else:
+        set_efficiency_alpha(topology, alpha)
+    stats = {name: (RunningStats(), RunningStats()) for name in strategies}
+    (paths, tables) = caches or _process_caches(path_cache, path_spill, table_cache)
+    seconds = {}
+    results = evaluate_strategies(topology, strategies, is_high=label, stats=stats, seconds=seconds, path_cache=paths, table_cache=tables)
+    for cache in (paths, tables):
+        if cache is not None:
+            cache.flush()
+    return trial, seed, results, stats, seconds
+
+
+def trial_config(**config) -> dict:
+    '''
+    The full run_trial configuration, defaults filled in, that a
+    ResultStore files results under.
+    '''
+    parameters = signature(run_trial).parameters
+    return {name: config.get(name, parameters[name].default) for name in parameters if name not in ("trial", "seed", "strategies", "caches")}
+
+
+def iter_trials(trials=100, workers=None, seed=None, skip=(), **config):
+    '''
+    Runs the trials, except those numbered in skip, and yields what
+    run_trial returns as each one finishes. workers=1 runs them in this
+    process, through caches opened for this call; worker processes open
+    their own.
+    '''
+    seeds = [(trial, trial_seed) for (trial, trial_seed) in enumerate(trial_seeds(trials, seed)) if trial not in skip]
+    if workers == 1:
+        with open_caches(config.get("path_cache", False), config.get("path_spill"), config.get("table_cache")) as caches:
+            for (trial, trial_seed) in seeds:
+                yield run_trial(trial, trial_seed, caches=caches, **config)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_trial, trial, trial_seed, **config) for (trial, trial_seed) in seeds]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def run_experiment(trials=100, workers=None, seed=None, on_result=None, strategies=("kx0shortest_path_qos",), store=None, **config) -> dict:
+    '''
+    Runs the trials of one configuration and aggregates them per strategy.
+    All strategies of a trial share its topology and parameter draws.
+
+    on_result, if given, is called with (trial, seed, results) as each trial
+    finishes. The returned dict maps each strategy to its summary: the
+    higher_better/lower_better counts (mean_hp against mean_lp), the
+    per-trial seeds and result tuples in trial order, the mean and standard
+    deviation of each tuple component across trials, and RunningStats of the
+    pair fidelities pooled over all trials.
+
+    With a ResultStore as store, every finished trial is written to it, and
+    trials whose seed it already holds for this configuration and all the
+    strategies are read back instead of run again. Pass a seed for that:
+    without one the trial seeds differ on every run.
+    '''
+    seeds = [None] * trials
+    summaries = {}
+    for name in strategies:
+        summaries[name] = {
+            "higher_better": 0,
+            "lower_better": 0,
+            "seeds": seeds,
+            "results": [None] * trials,
+            "hp_stats": RunningStats(),
+            "lp_stats": RunningStats(),
+        }
+    columns = {name: [RunningStats() for _ in range(4)] for name in strategies}
+
+    def record(trial, trial_seed, results, stats):
+        seeds[trial] = trial_seed
+        for (name, result) in results.items():
+            summary = summaries[name]
+            summary["hp_stats"].merge(stats[name][0])
+            summary["lp_stats"].merge(stats[name][1])
+            for (column, value) in zip(columns[name], result):
+                column.add(value)
+            summary["results"][trial] = result
+            if result[0] > result[2]:
+                summary["higher_better"] += 1
+            else:
+                summary["lower_better"] += 1
+
+    skip = set()
+    if store is not None:
+        full_config = trial_config(**config)
+        done = store.completed(full_config, strategies)
+        for (trial, trial_seed) in enumerate(trial_seeds(trials, seed)):
+            if trial_seed in done:
+                (_, results, stats, _) = done[trial_seed]
+                record(trial, trial_seed, results, stats)
+                skip.add(trial)
+    for (trial, trial_seed, results, stats, seconds) in iter_trials(trials, workers, seed, skip, strategies=strategies, **config):
+        record(trial, trial_seed, results, stats)
+        if store is not None:
+            store.add(full_config, trial, trial_seed, results, stats, seconds)
+        if on_result is not None:
+            on_result(trial, trial_seed, results)
+    if store is not None:
+        store.flush()
+
+    for (name, summary) in summaries.items():
+        summary["mean"] = tuple(column.mean_or_default() for column in columns[name])
+        summary["stddev"] = tuple(column.stddev_or_default() for column in columns[name])
+    return summaries
+
+
+def run_batched(trials=100, seed=None, generator="regular", n=6, frac=0.5, xi=0.9, alpha=None, strategies=("kx0shortest_path_qos",), on_result=None, path_cache=False, path_spill=None) -> dict:
+    '''
+    run_experiment with every trial scored in one evaluate_batched call
+    instead of one run_trial each, on array topologies.
+
+    All trials share one structure, so only generators with a single
+    structure, regular_gen, can be batched; a waxman experiment draws a new
+    one per trial. Each trial draws its efficiencies with draw_efficiencies
+    and its round(n*frac) high priority destinations, as the generators do,
+    from one numpy Generator seeded with seed. The trials are therefore not
+    those run_experiment gives for the same seed, but follow the same
+    distribution. on_result is called as in run_experiment, with seed None.
+    With path_cache, or a path_spill file, candidates go through a
+    PathCache as in run_trial. Returns summaries laid out as
+    run_experiment's, without per-trial seeds.
+    '''
+    if generator not in FIXED_STRUCTURE_GENERATORS:
+        raise ValueError(f"{generator} draws a new structure per trial and cannot be batched")
+    random.seed(seed)
+    rng = np.random.default_rng(seed)
+    topology = COMPACT_GENERATORS[generator](n, frac=0)
+    set_parameters(topology)
+    efficiency = draw_efficiencies(trials, len(topology), xi, alpha, rng)
+    high = np.argsort(rng.random((trials, n)), axis=1) < round(n*frac)
+    stats = {name: (RunningStats(), RunningStats()) for name in strategies}
+    with open_caches(path_cache, path_spill) as (paths, _):
+        results = evaluate_batched(topology, efficiency, strategies, high=high, stats=stats, path_cache=paths)
+    if on_result is not None:
+        for trial in range(trials):
+            on_result(trial, None, {name: tuple(results[name][trial].tolist()) for name in strategies})
+    summaries = {}
+    for name in strategies:
+        rows = results[name]
+        higher = int(np.count_nonzero(rows[:, 0] > rows[:, 2]))
+        columns = [RunningStats() for _ in range(4)]
+        for (column, values) in zip(columns, rows.T):
+            column.add_many(values)
+        summaries[name] = {
+            "higher_better": higher,
+            "lower_better": trials - higher,
+            "seeds": [None] * trials,
+            "results": [tuple(row) for row in rows.tolist()],
+            "hp_stats": stats[name][0],
+            "lp_stats": stats[name][1],
+            "mean": tuple(column.mean_or_default() for column in columns),
+            "stddev": tuple(column.stddev_or_default() for column in columns),
+        }
+    return summaries
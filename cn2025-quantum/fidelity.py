@@ -0,0 +1,162 @@
+import numpy as np
+import instrumentation
+
+INITIAL_FIDELITY = 0.975
+FIDELITY_THRESHOLD = 0.53
+TIE_TOLERANCE = 1e-12
+
+
+def node_factors(efficiency, fidelity) -> np.ndarray:
+    '''
+    Per-router factor of the end-to-end fidelity recurrence.
+
+    Swapping at a repeater maps F to (F-0.25)*((4*e**2-1)/3)*((4*f-1)/3)+0.25,
+    which is affine in F-0.25. A path's fidelity is therefore
+    0.25 + (INITIAL_FIDELITY-0.25) * prod(factor of every repeater).
+    '''
+    efficiency = np.asarray(efficiency, dtype=float)
+    fidelity = np.asarray(fidelity, dtype=float)
+    return ((4*efficiency**2 - 1)/3) * ((4*fidelity - 1)/3)
+
+
+class FidelityTable:
+    '''
+    Scores batches of router paths given as sequences of router indices.
+
+    Paths are full paths, source and destination included; only the
+    repeaters path[1:-1] contribute a factor. Products are taken as sums of
+    log|factor| with the sign tracked separately, and paths of different
+    lengths are padded with an extra index whose factor is 1.
+
+    monotone is true when every factor lies in [0, 1], so that adding a
+    repeater to a path never raises its fidelity.
+    '''
+    def __init__(self, factors):
+        self.factors = np.asarray(factors, dtype=float)
+        self.monotone = bool(np.all((self.factors >= 0) & (self.factors <= 1)))
+        self.pad = len(self.factors)
+        with np.errstate(divide="ignore"):
+            self.log_factors = np.append(np.log(np.abs(self.factors)), 0.0)
+        self.negative = np.append(self.factors < 0, False)
+
+    @classmethod
+    def from_params(cls, efficiency, fidelity):
+        return cls(node_factors(efficiency, fidelity))
+
+    def repeater_matrix(self, paths) -> np.ndarray:
+        width = max((len(path) - 2 for path in paths), default=0)
+        matrix = np.full((len(paths), max(width, 0)), self.pad, dtype=np.intp)
+        for (i, path) in enumerate(paths):
+            if len(path) > 2:
+                matrix[i, :len(path) - 2] = path[1:-1]
+        return matrix
+
+    def score_matrix(self, matrix) -> np.ndarray:
+        return self.score_sums(self.log_factors[matrix].sum(axis=1), self.negative[matrix].sum(axis=1) % 2 == 1)
+
+    def score_sums(self, log_products, negative) -> np.ndarray:
+        # fidelities from the summed log|factor| of each path's repeaters and the sign of their product
+        products = np.exp(log_products)
+        products[negative] *= -1
+        return (INITIAL_FIDELITY - 0.25)*products + 0.25
+
+    def score(self, paths) -> np.ndarray:
+        return self.score_matrix(self.repeater_matrix(paths))
+
+    def path_fidelity(self, path) -> float:
+        return float(self.score([path])[0])
+
+
+def above_threshold(fidelities) -> np.ndarray:
+    mask = np.asarray(fidelities) > FIDELITY_THRESHOLD
+    if instrumentation.active is not None:
+        instrumentation.count("paths_rejected", int(mask.size - np.count_nonzero(mask)))
+    return mask
+
+
+def select_path(fidelities, highest=False):
+    '''
+    Index of the lowest (or highest) fidelity above FIDELITY_THRESHOLD, or
+    None if no candidate passes. Ties go to the earliest candidate.
+    '''
+    fidelities = np.asarray(fidelities)
+    mask = above_threshold(fidelities)
+    if not mask.any():
+        return None
+    best = fidelities[mask].max() if highest else fidelities[mask].min()
+    return int(np.flatnonzero(mask & (np.abs(fidelities - best) <= TIE_TOLERANCE))[0])
+
+
+def first_above_threshold(fidelities):
+    mask = above_threshold(fidelities)
+    return int(mask.argmax()) if mask.any() else None
+
+
+def select_paths(fidelities, groups, n_groups, highest) -> np.ndarray:
+    '''
+    select_path applied to every group of candidates at once.
+
+    groups gives the group id of every candidate and highest is a boolean
+    array with one entry per group. Returns the chosen candidate index per
+    group, or -1 where no candidate passes the threshold.
+    '''
+    fidelities = np.asarray(fidelities, dtype=float)
+    groups = np.asarray(groups, dtype=np.intp)
+    key = np.where(np.asarray(highest, dtype=bool)[groups], -fidelities, fidelities)
+    mask = above_threshold(fidelities)
+    best = np.full(n_groups, np.inf)
+    np.minimum.at(best, groups[mask], key[mask])
+    hits = np.flatnonzero(mask & (key <= best[groups] + TIE_TOLERANCE))
+    chosen = np.full(n_groups, -1, dtype=np.intp)
+    hit_groups, first = np.unique(groups[hits], return_index=True)
+    chosen[hit_groups] = hits[first]
+    return chosen
+
+
+def score_batch(factors, matrix) -> np.ndarray:
+    '''
+    FidelityTable.score_matrix under many factor vectors at once: factors is
+    a (trials, routers) array and matrix a repeater_matrix padded with the
+    index routers. Returns the (trials, paths) fidelities.
+    '''
+    factors = np.asarray(factors, dtype=float)
+    pad = np.ones((len(factors), 1))
+    with np.errstate(divide="ignore"):
+        log_factors = np.log(np.abs(np.concatenate([factors, pad], axis=1)))
+    negative = np.concatenate([factors < 0, np.zeros(pad.shape, dtype=bool)], axis=1)
+    products = np.exp(log_factors[:, matrix].sum(axis=2))
+    products[negative[:, matrix].sum(axis=2) % 2 == 1] *= -1
+    return (INITIAL_FIDELITY - 0.25)*products + 0.25
+
+
+def select_batch(fidelities, offsets, highest) -> np.ndarray:
+    '''
+    select_paths for every row of a (trials, candidates) fidelity array,
+    returning fidelities instead of indices.
+
+    Candidates are grouped contiguously, group g being
+    offsets[g]:offsets[g+1], and highest broadcasts to (trials, groups).
+    Returns the (trials, groups) fidelity of the chosen candidate, 0 where
+    none passes the threshold.
+    '''
+    fidelities = np.asarray(fidelities, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.intp)
+    (trials, count) = fidelities.shape
+    lengths = np.diff(offsets)
+    chosen = np.zeros((trials, len(lengths)))
+    filled = np.flatnonzero(lengths > 0)
+    if len(filled) == 0:
+        return chosen
+    groups = np.repeat(np.arange(len(lengths)), lengths)
+    highest = np.broadcast_to(np.asarray(highest, dtype=bool), chosen.shape)
+    key = np.where(highest[:, groups], -fidelities, fidelities)
+    mask = above_threshold(fidelities)
+    # empty groups lie between the starts of filled ones, so reduceat skips them
+    best = np.full(chosen.shape, np.inf)
+    best[:, filled] = np.minimum.reduceat(np.where(mask, key, np.inf), offsets[filled], axis=1)
+    hits = mask & (key <= best[:, groups] + TIE_TOLERANCE)
+    first = np.minimum.reduceat(np.where(hits, np.arange(count), count), offsets[filled], axis=1)
+    found = first < count
+    picked = np.take_along_axis(fidelities, np.where(found, first, 0), axis=1)
+    chosen[:, filled] = np.where(found, picked, 0.0)
+    return chosen
@@ -0,0 +1,192 @@
+import numpy as np
+
+# next_hops entry of a router without a rule towards a destination
+NO_RULE = -1
+
+
+def next_hop_dtype(n: int):
+    return np.int16 if n <= np.iinfo(np.int16).max else np.int32
+
+
+class NextHops:
+    '''
+    Forwarding state of n routers, kept per destination. column(t) is an
+    int16/int32 array over router ids, the router each one forwards to for
+    destination t, NO_RULE where there is none. A destination gets a column
+    only once a rule towards it is written, so the state holds n entries
+    per routed destination rather than n*n: strategies evaluated on a few
+    hosts never fill the others.
+
+    next_hops[u, t] reads or writes rules towards the single destination t,
+    u a router id or an array of them.
+    '''
+    def __init__(self, n: int):
+        self.n = n
+        self.dtype = next_hop_dtype(n)
+        self.columns = {}
+
+    def __len__(self):
+        return self.n
+
+    def column(self, target: int) -> np.ndarray:
+        # the column of target, created without rules the first time
+        target = int(target)
+        column = self.columns.get(target)
+        if column is None:
+            column = self.columns[target] = np.full(self.n, NO_RULE, dtype=self.dtype)
+        return column
+
+    def __getitem__(self, key):
+        (u, target) = key
+        column = self.columns.get(int(target))
+        if column is None:
+            column = np.full(self.n, NO_RULE, dtype=self.dtype)
+        return column[u]
+
+    def __setitem__(self, key, value):
+        (u, target) = key
+        self.column(target)[u] = value
+
+    def targets(self) -> list:
+        return sorted(self.columns)
+
+    def clear(self, targets=None):
+        # drops the rules towards targets, or every rule
+        if targets is None:
+            self.columns.clear()
+        for target in targets or ():
+            self.columns.pop(int(target), None)
+
+    def matrix(self, targets) -> np.ndarray:
+        # the (n, len(targets)) array of the columns of targets
+        matrix = np.full((self.n, len(targets)), NO_RULE, dtype=self.dtype)
+        for (j, target) in enumerate(targets):
+            column = self.columns.get(int(target))
+            if column is not None:
+                matrix[:, j] = column
+        return matrix
+
+
+def walk(next_hops: NextHops, source: int, target: int):
+    '''
+    Router ids from source to target along next_hops, or None where a rule
+    is missing or the walk loops. A walk longer than n-1 hops must revisit
+    a router, so that is where a loop is caught.
+    '''
+    column = next_hops.columns.get(int(target))
+    if source == target or column is None:
+        return None
+    path = [source]
+    u = source
+    for _ in range(len(next_hops) - 1):
+        u = int(column[u])
+        if u == NO_RULE:
+            return None
+        path.append(u)
+        if u == target:
+            return path
+    return None
+
+
+def write_path(next_hops: NextHops, path):
+    # rules along a path of router ids towards its last router
+    path = np.asarray(path)
+    next_hops.column(path[-1])[path[:-1]] = path[1:]
+
+
+def rules(next_hops: NextHops) -> np.ndarray:
+    '''
+    Every rule of next_hops as an int32 (router, destination, next hop) row,
+    destinations in order and each destination's rules by router.
+    '''
+    blocks = [np.zeros((0, 3), dtype=np.int32)]
+    for target in next_hops.targets():
+        column = next_hops.columns[target]
+        u = np.flatnonzero(column != NO_RULE)
+        blocks.append(np.stack([u, np.full(len(u), target), column[u]], axis=1).astype(np.int32))
+    return np.concatenate(blocks)
+
+
+def tables(next_hops: NextHops, names, routers=None) -> dict:
+    '''
+    The forwarding tables by router name, destination name to next hop name,
+    of every router or of the router ids in routers.
+    '''
+    routers = np.arange(len(names)) if routers is None else np.asarray(routers, dtype=np.intp)
+    result = {names[u]: {} for u in routers.tolist()}
+    for target in next_hops.targets():
+        hops = next_hops.columns[target][routers]
+        for i in np.flatnonzero(hops != NO_RULE).tolist():
+            result[names[routers[i]]][names[target]] = names[hops[i]]
+    return result
+
+
+# status of a router's walk towards a destination, as evaluate() reports it
+REACHED = 0
+NO_ROUTE = 1
+LOOP = 2
+
+
+def evaluate(next_hops: NextHops, fidelity_table, targets=None):
+    '''
+    Fidelity, hop count and status of the walk from every router to each
+    router id in targets (all routers by default), as (n, len(targets))
+    arrays, without walking a single path.
+
+    Towards one destination the rules form an in-tree rooted there. All
+    trees are traversed together from their roots, one level per step, and
+    every router takes its next hop's partial log-product, so each
+    destination costs O(n). Routers never reached are NO_ROUTE when their
+    walk ends at a missing rule, which a second traversal from those routers
+    finds, and LOOP otherwise; they get fidelity 0 and hops -1. A
+    destination is REACHED from itself with 0 hops but fidelity 0, since
+    walk() gives no path there.
+    '''
+    n = len(next_hops)
+    targets = np.arange(n) if targets is None else np.asarray(targets, dtype=np.intp)
+    k = len(targets)
+    # node u*k + j is router u towards targets[j], its parent the next hop's node
+    columns = np.arange(k)
+    hop = next_hops.matrix(targets).astype(np.intp)
+    parent = np.where(hop == NO_RULE, -1, hop*k + columns).ravel()
+    roots = targets*k + columns
+    parent[roots] = -1
+    order = np.argsort(parent)
+    counts = np.bincount(parent[parent >= 0], minlength=n*k)
+    starts = np.count_nonzero(parent < 0) + np.cumsum(counts) - counts
+
+    hops = np.full(n*k, -1, dtype=np.intp)
+    log_products = np.zeros(n*k)
+    negative = np.zeros(n*k, dtype=bool)
+    hops[roots] = 0
+    for nodes in _levels(roots, order, starts, counts):
+        parents = parent[nodes]
+        hops[nodes] = hops[parents] + 1
+        # the root is the destination, not a repeater
+        repeater = hops[parents] > 0
+        routers = parents // k
+        log_products[nodes] = log_products[parents] + np.where(repeater, fidelity_table.log_factors[routers], 0.0)
+        negative[nodes] = negative[parents] ^ (repeater & fidelity_table.negative[routers])
+
+    status = np.full(n*k, LOOP, dtype=np.int8)
+    status[hops >= 0] = REACHED
+    dead_ends = np.flatnonzero(parent < 0)
+    dead_ends = dead_ends[hops[dead_ends] < 0]
+    status[dead_ends] = NO_ROUTE
+    for nodes in _levels(dead_ends, order, starts, counts):
+        status[nodes] = NO_ROUTE
+
+    fidelity = np.zeros(n*k)
+    routed = hops > 0
+    fidelity[routed] = fidelity_table.score_sums(log_products[routed], negative[routed])
+    return (fidelity.reshape(n, k), hops.reshape(n, k), status.reshape(n, k))
+
+
+def _levels(frontier, order, starts, counts):
+    # the children of frontier, then their children, and so on, one array per level
+    while frontier.size:
+        lengths = counts[frontier]
+        ends = np.cumsum(lengths)
+        frontier = order[np.repeat(starts[frontier] - ends + lengths, lengths) + np.arange(ends[-1])]
+        if frontier.size:
+            yield frontier
@@ -1,5 +1,8 @@
-import networkx as nx
+import numpy as np
 import random
+from scipy.spatial import ConvexHull
+from scipy.spatial.distance import cdist, pdist
+from compact_topology import CompactTopology
 def regular_gen(n: int, frac=0.3) -> dict:
     '''
     Returns a network topology following a regular graph structure in the form of a dict.
@@ -25,207 +28,101 @@ def regular_gen(n: int, frac=0.3) -> dict:
     '''
 
     # Dictionary structure referenced from: https://sequence-rtd-tutorial.readthedocs.io/en/latest/tutorial/chapter5/network_manager.html#step-1-create-the-network-configuration-file
-    seed = 0
-    graph = {
-        "is_parallel": False,
-        "stop_time": 2000000000000,
-        "nodes": [],
-        "qconnections": [],
-        "cconnections": []
-    }
+    return regular_gen_compact(n, frac).to_dict()
 
+def regular_gen_compact(n: int, frac=0.3) -> CompactTopology:
+    '''
+    regular_gen as a CompactTopology. s_i has id (i-1)*(n+2), the i-th
+    destination the id after it, and n_i_j the id (i-1)*(n+2)+1+j.
+    '''
     high_quality=random.sample(range(1, n+1), round(n*frac))
-    
+
     # Generating all nodes.
+    names = []
     for i in range(1, n+1):
-        src_dict = {
-            "name": ("s"+str(i)),
-            "type": "QuantumRouter",
-            "seed": seed,
-            "memo_size": 50
-        }
-        graph["nodes"].append(src_dict)
-        seed+=1
-        
-        dest_dict = {
-            "name": (("hd" if i in high_quality else "d") +str(i)),
-            "type": "QuantumRouter",
-            "seed": seed,
-            "memo_size": 50
-        }
-        graph["nodes"].append(dest_dict)
-        seed+=1
-        
+        names.append("s"+str(i))
+        names.append(("hd" if i in high_quality else "d")+str(i))
         for j in range(1, n+1):
-            node_dict = {
-                "name": ("n"+str(i)+"_"+str(j)),
-                "type": "QuantumRouter",
-                "seed": seed,
-                "memo_size": 50
-            }
-            graph["nodes"].append(node_dict)
-            seed+=1
+            names.append("n"+str(i)+"_"+str(j))
 
     # Generating all edges.
-    for i in range(1,n+1):
-        q_edge_src = {
-            "node1": "s"+str(i),
-            "node2": "n"+str(i)+"_1",
-            "attenuation": 0.0002,
-            "distance": 500,
-            "type": "meet_in_the_middle"
-        }
-        
-        c_edge_src = {
-            "node1": "s"+str(i),
-            "node2": "n"+str(i)+"_1",
-            "delay": 500000000
-        }
-        graph["qconnections"].append(q_edge_src)
-        graph["cconnections"].append(c_edge_src)
-        q_edge_dest = {
-            "node1": ("hd" if i in high_quality else "d")+str(i),
-            "node2": "n"+str(i)+"_"+str(n),
-            "attenuation": 0.0002,
-            "distance": 500,
-            "type": "meet_in_the_middle"
-        }
-        c_edge_dest = {
-            "node1": ("hd" if i in high_quality else "d")+str(i),
-            "node2": "n"+str(i)+"_"+str(n),
-            "delay": 500000000
-        }
-        graph["qconnections"].append(q_edge_dest)
-        graph["cconnections"].append(c_edge_dest)
-        
+    def repeater(i, j):
+        return (i-1)*(n+2)+1+j
+    u = []
+    v = []
+    for i in range(1, n+1):
+        u += [(i-1)*(n+2), (i-1)*(n+2)+1]
+        v += [repeater(i, 1), repeater(i, n)]
         for j in range(1, n+1):
             # Intralayer connection
             if n!=2 or i!=2:
-                q_edge_intra = {
-                    "node1": "n"+str(i)+"_"+str(j),
-                    "node2": "n"+str(1 if i==n else i+1)+"_"+str(j),
-                    "attenuation": 0.0002,
-                    "distance": 500,
-                    "type": "meet_in_the_middle"
-                }
-                c_edge_intra = {
-                    "node1": "n"+str(i)+"_"+str(j),
-                    "node2": "n"+str(1 if i==n else i+1)+"_"+str(j),
-                    "delay": 500000000
-                }
-                graph["qconnections"].append(q_edge_intra)
-                graph["cconnections"].append(c_edge_intra)
+                u.append(repeater(i, j))
+                v.append(repeater(1 if i==n else i+1, j))
             # Interlayer connection
             if j != n:
-                q_edge_inter = {
-                    "node1": "n"+str(i)+"_"+str(j),
-                    "node2": "n"+str(1)+"_"+str(j+1),
-                    "attenuation": 0.0002,
-                    "distance": 500,
-                    "type": "meet_in_the_middle"
-                }
-                c_edge_inter = {
-                    "node1": "n"+str(i)+"_"+str(j),
-                    "node2": "n"+str(1)+"_"+str(j+1),
-                    "delay": 500000000
-                }
-                graph["qconnections"].append(q_edge_inter)
-                graph["cconnections"].append(c_edge_inter)
-                
-    return graph    
-def waxman_gen(n: int, alpha = 0.85, beta=0.275, frac=0.3) -> dict:
-    G = nx.waxman_graph(n**2, alpha = alpha, beta = beta)
-    seed = 0
-    graph = {
-        "is_parallel": False,
-        "stop_time": 2000000000000,
-        "nodes": [],
-        "qconnections": [],
-        "cconnections": []
-    }
-    high_quality=random.sample(range(1, n+1), round(n*frac))
-    for i in range(1, n**2+1):
-        node_dict =  {
-                "name": ("n"+str(i)),
-                "type": "QuantumRouter",
-                "seed": seed,
-                "memo_size": 50
-        }
-        graph["nodes"].append(node_dict)
-        seed +=1
-        
+                u.append(repeater(i, j))
+                v.append(repeater(1, j+1))
+    return CompactTopology(names, u, v, np.full(len(u), 500))
 
+def waxman_gen(n: int, alpha = 0.85, beta=0.275, frac=0.3, seed=None) -> dict:
+    return waxman_gen_compact(n, alpha, beta, frac, seed).to_dict()
+
+def waxman_edges(size: int, alpha=0.85, beta=0.275, seed=None, block=1 << 20) -> tuple:
+    '''
+    Edges of a Waxman-1 random graph on size nodes, as nx.waxman_graph draws
+    them: uniform positions in the unit square, and every pair joined
+    independently with probability beta*exp(-d/(alpha*L)), L the largest
+    pairwise distance. seed is anything numpy.random.default_rng accepts.
+
+    Returns (u, v, length): edge endpoint arrays with u < v, in the order
+    nx.waxman_graph lists its edges, and the Euclidean length of each edge.
+    Pairs are drawn a block of rows at a time, about block pairs per block.
+    L is the diameter of the convex hull of the positions.
+    '''
+    rng = np.random.default_rng(seed)
+    pos = rng.random((size, 2))
+    if size < 2:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0))
+    hull = pos[ConvexHull(pos).vertices] if size > 2 else pos
+    L = pdist(hull).max()
+    rows = max(1, block // size)
+    (us, vs, lengths) = ([], [], [])
+    for start in range(0, size - 1, rows):
+        stop = min(start + rows, size - 1)
+        distance = cdist(pos[start:stop], pos[start + 1:])
+        # column c of row i is node start+1+c, a pair when it is above i
+        pair = np.arange(start + 1, size)[None, :] > np.arange(start, stop)[:, None]
+        join = pair & (rng.random(distance.shape) < beta*np.exp(-distance/(alpha*L)))
+        (i, c) = np.nonzero(join)
+        us.append(i + start)
+        vs.append(c + start + 1)
+        lengths.append(distance[i, c])
+    return (np.concatenate(us), np.concatenate(vs), np.concatenate(lengths))
+
+def waxman_gen_compact(n: int, alpha = 0.85, beta=0.275, frac=0.3, seed=None) -> CompactTopology:
+    '''
+    waxman_gen as a CompactTopology. Repeater n<i> has id i-1; s_k and the
+    k-th destination follow the n**2 repeaters in pairs.
+
+    Every draw comes from one numpy Generator seeded with seed, or, when
+    seed is None, from the global random state, so that random.seed still
+    fixes the topology.
+    '''
+    rng = np.random.default_rng(random.getrandbits(64) if seed is None else seed)
+    (edge_u, edge_v, length) = waxman_edges(n**2, alpha, beta, rng)
+    high_quality = set((rng.choice(n, round(n*frac), replace=False) + 1).tolist())
+    names = ["n"+str(i) for i in range(1, n**2+1)]
     for k in range(1, n+1):
-        src_dict =  {
-                "name": ("s"+str(k)),
-                "type": "QuantumRouter",
-                "seed": seed,
-                "memo_size": 50
-        }
-        seed+=1
-        dest_dict =  {
-                "name": (("hd" if k in high_quality else "d")+str(k)),
-                "type": "QuantumRouter",
-                "seed": seed,
-                "memo_size": 50
-        }
-        
-        seed +=1
-        graph["nodes"].append(src_dict)
-        graph["nodes"].append(dest_dict)
-        
-    for (u, v, _) in G.edges.data():
-        pos1 = G.nodes[u]["pos"]
-        pos2 = G.nodes[v]["pos"]
-        q_edge_dict = {
-            "node1": "n"+str(u+1),
-            "node2": "n"+str(v+1),
-            "attenuation": 0.0002,
-            "distance": round(1000*((pos2[1]-pos1[1])**2 +  (pos2[0]-pos1[0])**2)**0.5 ) ,
-            "type": "meet_in_the_middle"
-        }
-        c_edge_dict = {
-            "node1": "n"+str(u+1),
-            "node2": "n"+str(v+1),
-            "delay": 500000000
-        }
-        graph["qconnections"].append(q_edge_dict)
-        graph["cconnections"].append(c_edge_dict)
-
-    src_nodes = random.sample(range(1, n**2+1), n)
-    dest_nodes = random.sample(range(1, n**2+1), n)
+        names.append("s"+str(k))
+        names.append(("hd" if k in high_quality else "d")+str(k))
 
-    for i in range(1, n+1):
-        q_edge_dict_src = {
-            "node1": "s"+str(i),
-            "node2": "n"+str(src_nodes[i-1]),
-            "attenuation": 0.0002,
-            "distance": 500,
-            "type": "meet_in_the_middle"
-        }
-        c_edge_dict_src = {
-            "node1": "s"+str(i),
-            "node2": "n"+str(src_nodes[i-1]),
-            "delay": 500000000
-        }
-        graph["qconnections"].append(q_edge_dict_src)
-        graph["cconnections"].append(c_edge_dict_src)
-
-        q_edge_dict_dest = {
-            "node1": ("hd" if i in high_quality else "d")+str(i),
-            "node2": "n"+str(dest_nodes[i-1]),
-            "attenuation": 0.0002,
-            "distance": 500,
-            "type": "meet_in_the_middle"
-        }
-        c_edge_dict_dest = {
-            "node1": ("hd" if i in high_quality else "d")+str(i),
-            "node2": "n"+str(dest_nodes[i-1]),
-            "delay": 500000000
-        }
-        graph["qconnections"].append(q_edge_dict_dest)
-        graph["cconnections"].append(c_edge_dict_dest)
-    return graph
+    distance = np.rint(1000*length).astype(np.int64)
+    src_nodes = rng.choice(n**2, n, replace=False)
+    dest_nodes = rng.choice(n**2, n, replace=False)
+    endpoints = n**2 + np.arange(2*n)
+    u = np.concatenate([edge_u, endpoints])
+    v = np.concatenate([edge_v, np.stack([src_nodes, dest_nodes], axis=1).ravel()])
+    return CompactTopology(names, u, v, np.concatenate([distance, np.full(2*n, 500)]))
 
 def is_high(string: str) -> bool:
     if len(string) > 0:
@@ -0,0 +1,124 @@
+import cProfile
+import pstats
+import time
+from collections import Counter
+from contextlib import nullcontext
+from functools import wraps
+
+# the Collector receiving counts and timings, None while instrumentation is off
+active = None
+
+_NULL_TIMER = nullcontext()
+
+
+class Collector:
+    '''
+    Counters and per-call timings of the routing and metrics hot paths.
+
+    Instrumentation is off unless a collector is active: use it as a context
+    manager, and every count and timed call made inside the with block is
+    recorded on it. While no collector is active each hook costs one global
+    lookup and comparison. Collectors nest, the innermost one records.
+
+    counters holds event counts (graphs_built, get_components_by_type,
+    candidate_paths, paths_rejected, forwarding_rules, node_path_hops);
+    calls and seconds hold the number of calls and total wall time of every
+    timed function.
+    '''
+    def __init__(self):
+        self.counters = Counter()
+        self.calls = Counter()
+        self.seconds = Counter()
+        self._previous = []
+
+    def count(self, name: str, n=1):
+        self.counters[name] += n
+
+    def add_time(self, name: str, seconds: float):
+        self.calls[name] += 1
+        self.seconds[name] += seconds
+
+    def merge(self, other: "Collector"):
+        self.counters.update(other.counters)
+        self.calls.update(other.calls)
+        self.seconds.update(other.seconds)
+
+    def __enter__(self):
+        global active
+        self._previous.append(active)
+        active = self
+        return self
+
+    def __exit__(self, *exc):
+        global active
+        active = self._previous.pop()
+        return False
+
+    def report(self) -> str:
+        lines = ["counter\tcount"]
+        for (name, n) in sorted(self.counters.items()):
+            lines.append(f"{name}\t{n}")
+        lines.append("")
+        lines.append("function\tcalls\ttotal (s)\tper call (ms)")
+        for (name, seconds) in self.seconds.most_common():
+            calls = self.calls[name]
+            lines.append(f"{name}\t{calls}\t{seconds:.4f}\t\t{1000*seconds/calls:.3f}")
+        return "\n".join(lines)
+
+
+class _Timer:
+    def __init__(self, collector: Collector, name: str):
+        self.collector = collector
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.collector.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def count(name: str, n=1):
+    if active is not None:
+        active.count(name, n)
+
+
+def timer(name: str):
+    '''
+    Context manager timing its block under name on the active collector.
+    '''
+    if active is None:
+        return _NULL_TIMER
+    return _Timer(active, name)
+
+
+def timed(func):
+    '''
+    Decorator recording every call of func, under its name, on the active
+    collector.
+    '''
+    name = func.__name__
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        collector = active
+        if collector is None:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            collector.add_time(name, time.perf_counter() - start)
+    return wrapper
+
+
+def profile(path: str, func, *args, **kwargs):
+    '''
+    Calls func under cProfile, dumps the pstats output to path and returns
+    (result, stats).
+    '''
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, *args, **kwargs)
+    profiler.dump_stats(path)
+    return result, pstats.Stats(path)
@@ -1,51 +1,76 @@
 from sequence.topology.router_net_topo import RouterNetTopo
 from graph_builder import is_high
 import random
+import time
+from inspect import signature
+import numpy as np
 from network_generator import *
-
-def get_node_path(topology: RouterNetTopo, source, destination):
-    src_node = None
-    dst_node = None
-    for node in topology.nodes[topology.QUANTUM_ROUTER]:
-        if source == node.name:
-            src_node = node
-        elif destination == node.name:
-            dst_node = node
-
-    if src_node is None or dst_node is None:
+from routing_view import get_routing_view
+from compact_topology import CompactTopology
+import instrumentation
+import forwarding
+from table_cache import routed
+from fidelity import node_factors, score_batch, select_batch
+
+def _name_path(view, source, destination):
+    # router names along the forwarding state from source to destination
+    if source not in view.index or destination not in view.index:
         return None
+    path = forwarding.walk(view.next_hops, view.index[source], view.index[destination])
+    if path is None:
+        return None
+    instrumentation.count("node_path_hops", len(path) - 1)
+    return [view.names[u] for u in path]
 
-    path = []
-    current_node = src_node
-    while current_node.name != destination:
-        path.append(current_node)
-        table = current_node.network_manager.protocol_stack[0].forwarding_table
-        if destination not in table.keys():
-            return None
-        else:
-            next_hop = table[destination]
-            for node in topology.nodes[topology.QUANTUM_ROUTER]:
-                if next_hop == node.name:
-                    current_node = node
-                    break
-                path.append(current_node)
-    return path
+def get_node_path(topology: RouterNetTopo, source, destination):
+    '''
+    The routers along the forwarding tables from source to destination, or
+    None if the walk fails. For a CompactTopology they are router names.
+    '''
+    view = get_routing_view(topology)
+    path = _name_path(view, source, destination)
+    if path is None or not view.routers:
+        return path
+    return [view.router_by_name[name] for name in path]
 
 def calculate_fidelity(topology: RouterNetTopo, source, destination):
-    path = get_node_path(topology, source, destination)
+    view = get_routing_view(topology)
+    if source not in view.index or destination not in view.index:
+        return 0
+    path = forwarding.walk(view.next_hops, view.index[source], view.index[destination])
     if path is None:
         return 0
-    resulting_fidelity=0.975
-    for node in path[1:-1]:
-        fidelity= node.get_components_by_type("MemoryArray")[0][0].raw_fidelity
-        efficiency= node.get_components_by_type("MemoryArray")[0][0].efficiency
-        resulting_fidelity = (resulting_fidelity-0.25)*((4*efficiency**2-1)/3)*((4*fidelity-1)/3) + 0.25
-    return resulting_fidelity
+    instrumentation.count("node_path_hops", len(path) - 1)
+    return view.fidelity_table.path_fidelity(path)
+
+def calculate_fidelities(topology: RouterNetTopo, sources, destinations) -> dict:
+    '''
+    calculate_fidelity of every (source, destination) pair of router names,
+    from one forwarding.evaluate over the destinations instead of a walk
+    per pair.
+    '''
+    view = get_routing_view(topology)
+    pair_fidelities = {(source, destination): 0 for source in sources for destination in destinations}
+    known_sources = [source for source in sources if source in view.index]
+    known_destinations = [destination for destination in destinations if destination in view.index]
+    if not known_sources or not known_destinations:
+        return pair_fidelities
+    rows = [view.index[source] for source in known_sources]
+    (fidelity, hops, _) = forwarding.evaluate(view.next_hops, view.fidelity_table, [view.index[destination] for destination in known_destinations])
+    fidelity = fidelity[rows]
+    instrumentation.count("node_path_hops", int(hops[rows].clip(0).sum()))
+    for (i, source) in enumerate(known_sources):
+        pair_fidelities.update(zip([(source, destination) for destination in known_destinations], fidelity[i].tolist()))
+    return pair_fidelities
+
 def print_forwarding_tables(topology: RouterNetTopo):
-    for node in topology.nodes[topology.QUANTUM_ROUTER]:
-        print(node.name, node.network_manager.protocol_stack[0].forwarding_table)
+    view = get_routing_view(topology)
+    for (name, table) in forwarding.tables(view.next_hops, view.names).items():
+        print(name, table)
         
 def get_source_nodes(topology: RouterNetTopo):
+    if isinstance(topology, CompactTopology):
+        return topology.sources()
     nodes=[]
     for node in topology.nodes[topology.QUANTUM_ROUTER]:
         if 's' in node.name:
@@ -53,6 +78,8 @@ def get_source_nodes(topology: RouterNetTopo):
     return nodes
 
 def get_dest_nodes(topology: RouterNetTopo):
+    if isinstance(topology, CompactTopology):
+        return topology.destinations()
     nodes=[]
     for node in topology.nodes[topology.QUANTUM_ROUTER]:
         if 'd' in node.name:
@@ -77,171 +104,330 @@ def find_stddev(num_list):
         sum+= (i-mean)**2
     return (sum/n)**0.5
 
-def evaluate_shortest_path(topology: RouterNetTopo, is_high=is_high, get_source_nodes=get_source_nodes, get_dest_nodes=get_dest_nodes):
-    clear_forwarding_tables(topology)
-    gen_tables_shortest_path(topology)
-    source_nodes = get_source_nodes(topology)
-    dest_nodes = get_dest_nodes(topology)
-    hp_nodes = list(filter(lambda x: is_high(x.name), dest_nodes))
-    lp_nodes = list(filter(lambda x: not is_high(x.name), dest_nodes))
-    hp_fidelities = []
-    lp_fidelities = []
-    for source in source_nodes:
-        for destination in hp_nodes:
-            fidelity = calculate_fidelity(topology, source.name, destination.name)
-            hp_fidelities.append(fidelity)
-        for destination in lp_nodes:
-            fidelity = calculate_fidelity(topology, source.name, destination.name)
-            lp_fidelities.append(fidelity)
-
-
-    return (find_mean(hp_fidelities), find_stddev(hp_fidelities), find_mean(lp_fidelities), find_stddev(lp_fidelities))
-
-
-def evaluate_efficiency_cost(topology: RouterNetTopo, is_high=is_high, get_source_nodes=get_source_nodes, get_dest_nodes=get_dest_nodes):
-    clear_forwarding_tables(topology)
-    gen_tables_efficiency_cost(topology)
-    source_nodes = get_source_nodes(topology)
-    dest_nodes = get_dest_nodes(topology)
-    hp_nodes = list(filter(lambda x: is_high(x.name), dest_nodes))
-    lp_nodes = list(filter(lambda x: not is_high(x.name), dest_nodes))
-    hp_fidelities = []
-    lp_fidelities = []
-    for source in source_nodes:
-        for destination in hp_nodes:
-            fidelity = calculate_fidelity(topology, source.name, destination.name)
-            hp_fidelities.append(fidelity)
-        for destination in lp_nodes:
-            fidelity = calculate_fidelity(topology, source.name, destination.name)
-            lp_fidelities.append(fidelity)
-
-
-    return (find_mean(hp_fidelities), find_stddev(hp_fidelities), find_mean(lp_fidelities), find_stddev(lp_fidelities))
-
-def evaluate_kshortest_path(topology: RouterNetTopo, is_high=is_high, get_source_nodes=get_source_nodes, get_dest_nodes=get_dest_nodes):
-    clear_forwarding_tables(topology)
-    source_nodes = get_source_nodes(topology)
-    dest_nodes = get_dest_nodes(topology)
-    hp_nodes = list(filter(lambda x: is_high(x.name), dest_nodes))
-    lp_nodes = list(filter(lambda x: not is_high(x.name), dest_nodes))
-    hp_fidelities = []
-    lp_fidelities = []
-    for source in source_nodes:
-        for destination in hp_nodes:
-            gen_tables_kshortest_path(topology, source.name, destination.name)
-            fidelity = calculate_fidelity(topology, source.name, destination.name)
-            hp_fidelities.append(fidelity)
-        for destination in lp_nodes:
-            gen_tables_kshortest_path(topology, source.name, destination.name)
-            fidelity = calculate_fidelity(topology, source.name, destination.name)
-            lp_fidelities.append(fidelity)
-
-
-    return (find_mean(hp_fidelities), find_stddev(hp_fidelities), find_mean(lp_fidelities), find_stddev(lp_fidelities))
-
-def evaluate_kxshortest_path(topology: RouterNetTopo, is_high=is_high, get_source_nodes=get_source_nodes, get_dest_nodes=get_dest_nodes):
-    clear_forwarding_tables(topology)
-    source_nodes = get_source_nodes(topology)
-    dest_nodes = get_dest_nodes(topology)
-    hp_nodes = list(filter(lambda x: is_high(x.name), dest_nodes))
-    lp_nodes = list(filter(lambda x: not is_high(x.name), dest_nodes))
-    hp_fidelities = []
-    lp_fidelities = []
-    for source in source_nodes:
-        for destination in hp_nodes:
-            gen_tables_kxshortest_path(topology, source.name, destination.name)
-            fidelity = calculate_fidelity(topology, source.name, destination.name)
-            hp_fidelities.append(fidelity)
-        for destination in lp_nodes:
-            gen_tables_kxshortest_path(topology, source.name, destination.name)
-            fidelity = calculate_fidelity(topology, source.name, destination.name)
-            lp_fidelities.append(fidelity)
-
-
-    return (find_mean(hp_fidelities), find_stddev(hp_fidelities), find_mean(lp_fidelities), find_stddev(lp_fidelities))
-
-def evaluate_kx0shortest_path(topology: RouterNetTopo, is_high=is_high, get_source_nodes=get_source_nodes, get_dest_nodes=get_dest_nodes):
-    clear_forwarding_tables(topology)
-    source_nodes = get_source_nodes(topology)
-    dest_nodes = get_dest_nodes(topology)
-    hp_nodes = list(filter(lambda x: is_high(x.name), dest_nodes))
-    lp_nodes = list(filter(lambda x: not is_high(x.name), dest_nodes))
-    hp_fidelities = []
-    lp_fidelities = []
-    for source in source_nodes:
-        for destination in hp_nodes:
-            gen_tables_kxshortest_path(topology, source.name, destination.name, x=0)
-            fidelity = calculate_fidelity(topology, source.name, destination.name)
-            hp_fidelities.append(fidelity)
-        for destination in lp_nodes:
-            gen_tables_kxshortest_path(topology, source.name, destination.name, x=0)
-            fidelity = calculate_fidelity(topology, source.name, destination.name)
-            lp_fidelities.append(fidelity)
-
-
-    return (find_mean(hp_fidelities), find_stddev(hp_fidelities), find_mean(lp_fidelities), find_stddev(lp_fidelities))
-
-
-def evaluate_kshortest_path_qos(topology: RouterNetTopo, is_high=is_high, get_source_nodes=get_source_nodes, get_dest_nodes=get_dest_nodes):
-    clear_forwarding_tables(topology)
-    source_nodes = get_source_nodes(topology)
-    dest_nodes = get_dest_nodes(topology)
-    hp_nodes = list(filter(lambda x: is_high(x.name), dest_nodes))
-    lp_nodes = list(filter(lambda x: not is_high(x.name), dest_nodes))
-    hp_fidelities = []
-    lp_fidelities = []
-    for source in source_nodes:
-        for destination in hp_nodes:
-            gen_tables_kshortest_path_qos(topology, source.name, destination.name)
-            fidelity = calculate_fidelity(topology, source.name, destination.name)
-            hp_fidelities.append(fidelity)
-        for destination in lp_nodes:
-            gen_tables_kshortest_path_qos(topology, source.name, destination.name)
-            fidelity = calculate_fidelity(topology, source.name, destination.name)
-            lp_fidelities.append(fidelity)
-
-
-    return (find_mean(hp_fidelities), find_stddev(hp_fidelities), find_mean(lp_fidelities), find_stddev(lp_fidelities))
-
-def evaluate_kxshortest_path_qos(topology: RouterNetTopo, is_high=is_high, get_source_nodes=get_source_nodes, get_dest_nodes=get_dest_nodes):
-    clear_forwarding_tables(topology)
-    source_nodes = get_source_nodes(topology)
-    dest_nodes = get_dest_nodes(topology)
-    hp_nodes = list(filter(lambda x: is_high(x.name), dest_nodes))
-    lp_nodes = list(filter(lambda x: not is_high(x.name), dest_nodes))
-    hp_fidelities = []
-    lp_fidelities = []
-    for source in source_nodes:
-        for destination in hp_nodes:
-            gen_tables_kxshortest_path_qos(topology, source.name, destination.name)
-            fidelity = calculate_fidelity(topology, source.name, destination.name)
-            hp_fidelities.append(fidelity)
-        for destination in lp_nodes:
-            gen_tables_kxshortest_path_qos(topology, source.name, destination.name)
-            fidelity = calculate_fidelity(topology, source.name, destination.name)
-            lp_fidelities.append(fidelity)
-
-
-    return (find_mean(hp_fidelities), find_stddev(hp_fidelities), find_mean(lp_fidelities), find_stddev(lp_fidelities))
-
-
-def evaluate_kx0shortest_path_qos(topology: RouterNetTopo, is_high=is_high, get_source_nodes=get_source_nodes, get_dest_nodes=get_dest_nodes):
-    clear_forwarding_tables(topology)
+class RunningStats:
+    '''
+    Streaming count, mean, M2 (Welford), min and max of a stream of
+    fidelities, with an optional fixed-bin histogram.
+
+    Accumulators merge exactly (Chan et al.), so per-trial or per-process
+    statistics fold together in O(1) memory. mean_or_default and
+    stddev_or_default follow find_mean and find_stddev: population standard
+    deviation, and -1 for an empty stream.
+    '''
+    def __init__(self, bins=None, low=0.0, high=1.0):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.bin_edges = None
+        self.histogram = None
+        if bins is not None:
+            self.bin_edges = np.linspace(low, high, bins + 1)
+            self.histogram = np.zeros(bins, dtype=np.int64)
+
+    def add(self, value):
+        value = float(value)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if self.histogram is not None:
+            self._bin(np.array([value]))
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        if len(values) == 0:
+            return
+        batch = RunningStats()
+        batch.count = len(values)
+        batch.mean = float(values.mean())
+        batch.m2 = float(((values - batch.mean)**2).sum())
+        batch.min = float(values.min())
+        batch.max = float(values.max())
+        self._merge_moments(batch)
+        if self.histogram is not None:
+            self._bin(values)
+
+    def merge(self, other: "RunningStats"):
+        self._merge_moments(other)
+        if self.histogram is not None and other.histogram is not None:
+            assert np.array_equal(self.bin_edges, other.bin_edges), "histograms must share bins"
+            self.histogram += other.histogram
+        return self
+
+    def _merge_moments(self, other: "RunningStats"):
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def _bin(self, values):
+        # values on the upper edge go to the last bin, as in numpy.histogram
+        index = np.clip(np.searchsorted(self.bin_edges, values, side="right") - 1, 0, len(self.histogram) - 1)
+        inside = (values >= self.bin_edges[0]) & (values <= self.bin_edges[-1])
+        np.add.at(self.histogram, index[inside], 1)
+
+    def variance(self) -> float:
+        return self.m2 / self.count if self.count > 0 else -1
+
+    def mean_or_default(self) -> float:
+        return self.mean if self.count > 0 else -1
+
+    def stddev_or_default(self) -> float:
+        return self.variance()**0.5 if self.count > 0 else -1
+
+
+def _summarize(hp: RunningStats, lp: RunningStats, hp_stats: RunningStats, lp_stats: RunningStats):
+    if hp_stats is not None:
+        hp_stats.merge(hp)
+    if lp_stats is not None:
+        lp_stats.merge(lp)
+    return (hp.mean_or_default(), hp.stddev_or_default(), lp.mean_or_default(), lp.stddev_or_default())
+
+STRATEGIES = {}
+# (k, x, rule) of the strategies evaluate_batched can score: a pair's
+# candidates are its first k paths (all of them for None) in Yen's order,
+# or from bounded_simple_paths with x, and it takes the "highest" or
+# "lowest" fidelity above the threshold, or picks by priority for "qos".
+# Filled from the batch attribute of registered strategies.
+BATCHED_STRATEGIES = {}
+# (x, qos) of the strategies that choose one path per pair: x None for
+# Yen's candidates, and whether the choice depends on is_high. Filled from
+# the pair attribute of registered strategies.
+PAIR_STRATEGIES = {}
+
+def register_strategy(name):
+    '''
+    Registers a routing strategy for evaluate_strategies. A strategy is called
+    as route(topology, view, sources, destinations, is_high, path_cache,
+    table_cache) with router names and the caches it may go through (None
+    for none), and returns {(source, destination): fidelity} for every
+    pair, 0 where no route was found. A route with a batch attribute, its (k, x,
+    rule), can also be scored by evaluate_batched, and one with a pair
+    attribute, its (x, qos), kept current by a DynamicRouter.
+    '''
+    def register(route):
+        STRATEGIES[name] = route
+        for (attribute, registry) in (("batch", BATCHED_STRATEGIES), ("pair", PAIR_STRATEGIES)):
+            if getattr(route, attribute, None) is not None:
+                registry[name] = getattr(route, attribute)
+            else:
+                registry.pop(name, None)
+        return route
+    return register
+
+def _table_strategy(gen_tables, batch=None):
+    # strategies that install a full forwarding table, measured on its trees
+    def route(topology: RouterNetTopo, view, sources, destinations, is_high, path_cache=None, table_cache=None):
+        clear_forwarding_tables(topology)
+        # only the destinations that are scored get rules
+        strategy = gen_tables.__name__ + repr(list(destinations))
+        routed(table_cache, view, strategy, lambda: gen_tables(topology, view=view, push=False, destinations=destinations))
+        return calculate_fidelities(topology, sources, destinations)
+    route.batch = batch
+    return route
+
+def _pair_parameters(gen_tables_all, strategy_args):
+    # the (k, x) a pair strategy routes with, defaults filled in
+    parameters = signature(gen_tables_all).parameters
+    k = strategy_args.get("k", parameters["k"].default)
+    x = strategy_args.get("x", parameters["x"].default) if "x" in parameters else None
+    return (k, x)
+
+def _pair_batch(gen_tables_all, qos, strategy_args):
+    # the (k, x, rule) of a pair strategy, from the arguments it routes with
+    (k, x) = _pair_parameters(gen_tables_all, strategy_args)
+    if qos and x is not None:
+        # the kx QoS search covers every path of at most d+x hops
+        k = None
+    return (k, x, "qos" if qos else "lowest")
+
+def _pair_strategy(gen_tables_all, qos=False, **strategy_args):
+    # strategies that choose one path per pair, measured on the chosen path
+    strategy = gen_tables_all.__name__ + repr(sorted(strategy_args.items()))
+    def route(topology: RouterNetTopo, view, sources, destinations, is_high, path_cache=None, table_cache=None):
+        clear_forwarding_tables(topology)
+        qos_args = {"is_high": is_high} if qos else {}
+        pairs = [(source, destination) for source in sources for destination in destinations if source != destination]
+        compute = lambda: gen_tables_all(topology, sources, destinations, view=view, push=False, path_cache=path_cache, **qos_args, **strategy_args)
+        final_paths = routed(table_cache, view, strategy, compute, pairs, is_high if qos else None)
+        scored_pairs = [pair for (pair, path) in final_paths.items() if path is not None]
+        scores = view.fidelity_table.score([view.path_indices(final_paths[pair]) for pair in scored_pairs])
+        # a pair with no route, or of a router with itself, counts as 0
+        pair_fidelities = {(source, destination): 0 for source in sources for destination in destinations}
+        pair_fidelities.update(zip(scored_pairs, scores.tolist()))
+        return pair_fidelities
+    route.batch = _pair_batch(gen_tables_all, qos, strategy_args)
+    route.pair = (_pair_parameters(gen_tables_all, strategy_args)[1], qos)
+    return route
+
+# shortest_path's tables give each source its best shortest path above the threshold
+register_strategy("shortest_path")(_table_strategy(gen_tables_shortest_path, batch=(None, 0, "highest")))
+register_strategy("efficiency_cost")(_table_strategy(gen_tables_efficiency_cost))
+register_strategy("kshortest_path")(_pair_strategy(gen_tables_kshortest_path_all))
+register_strategy("kxshortest_path")(_pair_strategy(gen_tables_kxshortest_path_all))
+register_strategy("kx0shortest_path")(_pair_strategy(gen_tables_kxshortest_path_all, x=0))
+register_strategy("kshortest_path_qos")(_pair_strategy(gen_tables_kshortest_path_qos_all, qos=True))
+register_strategy("kxshortest_path_qos")(_pair_strategy(gen_tables_kxshortest_path_qos_all, qos=True))
+register_strategy("kx0shortest_path_qos")(_pair_strategy(gen_tables_kxshortest_path_qos_all, qos=True, x=0))
+
+
+def evaluate_strategies(topology: RouterNetTopo, strategies=None, is_high=is_high, get_source_nodes=get_source_nodes, get_dest_nodes=get_dest_nodes, stats=None, seconds=None, path_cache=None, table_cache=None) -> dict:
+    '''
+    Evaluates several registered strategies (all of them by default) on one
+    topology in one pass. The routing view, its fidelity table and the
+    source/destination classification are computed once and shared.
+
+    Returns {name: (mean_hp, stddev_hp, mean_lp, stddev_lp)}. stats may map
+    a strategy name to a (hp_stats, lp_stats) pair of RunningStats that the
+    strategy's pair fidelities are folded into. seconds, if given, is a dict
+    that receives the wall time of every strategy. path_cache and
+    table_cache, a PathCache and a TableCache, let the strategies reuse
+    candidate paths and routed tables. topology may be a CompactTopology,
+    which is routed and scored without SeQUeNCe.
+    '''
+    if strategies is None:
+        strategies = list(STRATEGIES)
+    view = get_routing_view(topology)
     source_nodes = get_source_nodes(topology)
     dest_nodes = get_dest_nodes(topology)
-    hp_nodes = list(filter(lambda x: is_high(x.name), dest_nodes))
-    lp_nodes = list(filter(lambda x: not is_high(x.name), dest_nodes))
-    hp_fidelities = []
-    lp_fidelities = []
-    for source in source_nodes:
-        for destination in hp_nodes:
-            gen_tables_kxshortest_path_qos(topology, source.name, destination.name, x=0)
-            fidelity = calculate_fidelity(topology, source.name, destination.name)
-            hp_fidelities.append(fidelity)
-        for destination in lp_nodes:
-            gen_tables_kxshortest_path_qos(topology, source.name, destination.name, x=0)
-            fidelity = calculate_fidelity(topology, source.name, destination.name)
-            lp_fidelities.append(fidelity)
-
-
-    return (find_mean(hp_fidelities), find_stddev(hp_fidelities), find_mean(lp_fidelities), find_stddev(lp_fidelities))
+    # a CompactTopology lists routers by name
+    sources = [getattr(source, "name", source) for source in source_nodes]
+    dest_names = [getattr(destination, "name", destination) for destination in dest_nodes]
+    hp_names = [name for name in dest_names if is_high(name)]
+    lp_names = [name for name in dest_names if not is_high(name)]
+    results = {}
+    for name in strategies:
+        start = time.perf_counter()
+        with instrumentation.timer("strategy:" + name):
+            pair_fidelities = STRATEGIES[name](topology, view, sources, hp_names + lp_names, is_high, path_cache, table_cache)
+        if seconds is not None:
+            seconds[name] = time.perf_counter() - start
+        hp = RunningStats()
+        lp = RunningStats()
+        hp.add_many([pair_fidelities[(source, destination)] for source in sources for destination in hp_names])
+        lp.add_many([pair_fidelities[(source, destination)] for source in sources for destination in lp_names])
+        hp_stats, lp_stats = (stats or {}).get(name, (None, None))
+        results[name] = _summarize(hp, lp, hp_stats, lp_stats)
+    return results
+
+def _batched_candidates(view, pairs, k, x, path_cache=None):
+    # every pair's candidates as one repeater matrix, and where each pair's rows start
+    distances = {}
+    paths = []
+    offsets = [0]
+    for (source, destination) in pairs:
+        paths.extend(candidate_indices(view, source, destination, k, x, distances, path_cache))
+        offsets.append(len(paths))
+    instrumentation.count("candidate_paths", len(paths))
+    return (view.fidelity_table.repeater_matrix(paths), np.array(offsets))
+
+def _batched_summary(values, mask):
+    # per-row mean_or_default and stddev_or_default of the masked values
+    count = mask.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(mask, values, 0.0).sum(axis=1)/count
+        variance = np.where(mask, (values - mean[:, None])**2, 0.0).sum(axis=1)/count
+    return (np.where(count > 0, mean, -1), np.where(count > 0, variance**0.5, -1))
+
+def evaluate_batched(topology: RouterNetTopo, efficiency, strategies=None, high=None, is_high=is_high, get_source_nodes=get_source_nodes, get_dest_nodes=get_dest_nodes, stats=None, chunk=1 << 22, path_cache=None) -> dict:
+    '''
+    evaluate_strategies for a batch of trials that share the structure of
+    topology and differ in their memory efficiencies, and possibly in which
+    destinations are high priority.
+
+    efficiency is a (trials, routers) array in router id order, as
+    draw_efficiencies returns it. high is a (trials, destinations) boolean
+    array over get_dest_nodes, by default is_high of their names in every
+    trial. Every pair's candidates are enumerated once, scored under all
+    rows together, chunk scores at a time, and each strategy's rule picks
+    per trial. Only the chosen fidelity matters, so ties need no breaking.
+
+    Returns {name: (trials, 4) array}, row t the
+    (mean_hp, stddev_hp, mean_lp, stddev_lp) tuple of trial t; stats folds
+    in the pair fidelities of all trials, as in evaluate_strategies, and
+    the candidates go through path_cache when one is given.
+    Strategies must be in BATCHED_STRATEGIES, and the fidelity factors in
+    [0, 1], as every set_efficiency_xi or set_efficiency_alpha draw gives.
+    '''
+    if strategies is None:
+        strategies = list(BATCHED_STRATEGIES)
+    unbatched = [name for name in strategies if name not in BATCHED_STRATEGIES]
+    if unbatched:
+        raise ValueError(f"strategies {unbatched} route on more than path fidelities and cannot be batched")
+    view = get_routing_view(topology)
+    efficiency = np.atleast_2d(np.asarray(efficiency, dtype=float))
+    factors = node_factors(efficiency, view.fidelity)
+    if np.any((factors < 0) | (factors > 1)):
+        raise ValueError("batched evaluation needs fidelity factors in [0, 1]")
+    sources = [getattr(source, "name", source) for source in get_source_nodes(topology)]
+    dest_names = [getattr(destination, "name", destination) for destination in get_dest_nodes(topology)]
+    if high is None:
+        high = [[bool(is_high(name)) for name in dest_names]]
+    high = np.broadcast_to(np.asarray(high, dtype=bool), (len(efficiency), len(dest_names)))
+    pairs = []
+    pair_destinations = []
+    for source in sources:
+        for (j, destination) in enumerate(dest_names):
+            if source != destination:
+                pairs.append((source, destination))
+                pair_destinations.append(j)
+    pair_high = high[:, pair_destinations]
+    candidates = {}
+    results = {}
+    for name in strategies:
+        (k, x, rule) = BATCHED_STRATEGIES[name]
+        with instrumentation.timer("batched:" + name):
+            if (k, x) not in candidates:
+                candidates[(k, x)] = _batched_candidates(view, pairs, k, x, path_cache)
+            (matrix, offsets) = candidates[(k, x)]
+            highest = ~pair_high if rule == "qos" else np.full((1, len(pairs)), rule == "highest")
+            highest = np.broadcast_to(highest, pair_high.shape)
+            pair_fidelities = np.zeros(pair_high.shape)
+            rows = max(1, chunk // max(1, matrix.size))
+            for start in range(0, len(efficiency), rows):
+                block = slice(start, start + rows)
+                pair_fidelities[block] = select_batch(score_batch(factors[block], matrix), offsets, highest[block])
+        hp_stats, lp_stats = (stats or {}).get(name, (None, None))
+        if hp_stats is not None:
+            hp_stats.add_many(pair_fidelities[pair_high])
+        if lp_stats is not None:
+            lp_stats.add_many(pair_fidelities[~pair_high])
+        results[name] = np.stack(_batched_summary(pair_fidelities, pair_high) + _batched_summary(pair_fidelities, ~pair_high), axis=1)
+    return results
+
+def evaluate_strategy(topology: RouterNetTopo, name, is_high=is_high, get_source_nodes=get_source_nodes, get_dest_nodes=get_dest_nodes, hp_stats=None, lp_stats=None):
+    return evaluate_strategies(topology, [name], is_high, get_source_nodes, get_dest_nodes, {name: (hp_stats, lp_stats)})[name]
+
+
+def evaluate_shortest_path(topology: RouterNetTopo, is_high=is_high, get_source_nodes=get_source_nodes, get_dest_nodes=get_dest_nodes, hp_stats=None, lp_stats=None):
+    return evaluate_strategy(topology, "shortest_path", is_high, get_source_nodes, get_dest_nodes, hp_stats, lp_stats)
+
+def evaluate_efficiency_cost(topology: RouterNetTopo, is_high=is_high, get_source_nodes=get_source_nodes, get_dest_nodes=get_dest_nodes, hp_stats=None, lp_stats=None):
+    return evaluate_strategy(topology, "efficiency_cost", is_high, get_source_nodes, get_dest_nodes, hp_stats, lp_stats)
+
+def evaluate_kshortest_path(topology: RouterNetTopo, is_high=is_high, get_source_nodes=get_source_nodes, get_dest_nodes=get_dest_nodes, hp_stats=None, lp_stats=None):
+    return evaluate_strategy(topology, "kshortest_path", is_high, get_source_nodes, get_dest_nodes, hp_stats, lp_stats)
+
+def evaluate_kxshortest_path(topology: RouterNetTopo, is_high=is_high, get_source_nodes=get_source_nodes, get_dest_nodes=get_dest_nodes, hp_stats=None, lp_stats=None):
+    return evaluate_strategy(topology, "kxshortest_path", is_high, get_source_nodes, get_dest_nodes, hp_stats, lp_stats)
+
+def evaluate_kx0shortest_path(topology: RouterNetTopo, is_high=is_high, get_source_nodes=get_source_nodes, get_dest_nodes=get_dest_nodes, hp_stats=None, lp_stats=None):
+    return evaluate_strategy(topology, "kx0shortest_path", is_high, get_source_nodes, get_dest_nodes, hp_stats, lp_stats)
+
+def evaluate_kshortest_path_qos(topology: RouterNetTopo, is_high=is_high, get_source_nodes=get_source_nodes, get_dest_nodes=get_dest_nodes, hp_stats=None, lp_stats=None):
+    return evaluate_strategy(topology, "kshortest_path_qos", is_high, get_source_nodes, get_dest_nodes, hp_stats, lp_stats)
+
+def evaluate_kxshortest_path_qos(topology: RouterNetTopo, is_high=is_high, get_source_nodes=get_source_nodes, get_dest_nodes=get_dest_nodes, hp_stats=None, lp_stats=None):
+    return evaluate_strategy(topology, "kxshortest_path_qos", is_high, get_source_nodes, get_dest_nodes, hp_stats, lp_stats)
+
+def evaluate_kx0shortest_path_qos(topology: RouterNetTopo, is_high=is_high, get_source_nodes=get_source_nodes, get_dest_nodes=get_dest_nodes, hp_stats=None, lp_stats=None):
+    return evaluate_strategy(topology, "kx0shortest_path_qos", is_high, get_source_nodes, get_dest_nodes, hp_stats, lp_stats)
@@ -3,18 +3,134 @@ from sequence.topology.router_net_topo import RouterNetTopo
 from sequence.topology.topology import Topology as Topo
 import random
 import math
-from networkx import Graph, all_shortest_paths, shortest_simple_paths, exception, shortest_path_length
+from itertools import islice, chain
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from networkx import Graph, all_shortest_paths, single_source_dijkstra_path, shortest_simple_paths, exception, single_source_shortest_path_length
 from graph_builder import is_high
+from compact_topology import CompactTopology
+from routing_view import RoutingView, DEFAULT_FIDELITY, DEFAULT_EFFICIENCY, get_routing_view, invalidate_routing_view
+from fidelity import INITIAL_FIDELITY, FIDELITY_THRESHOLD, select_path, select_paths, first_above_threshold
+from qos_search import hop_distances, completion_bounds, qos_path, shortest_path_labels, cost_path_labels
+import instrumentation
+import forwarding
+from path_cache import pair_key
 import json
 import os
+import tempfile
+class DictRouterNetTopo(RouterNetTopo):
+    '''
+    RouterNetTopo built straight from a config dict, without a JSON file.
+
+    _load mirrors RouterNetTopo._load after its json.load step. The top level
+    lists of the config are copied first, since loading appends the generated
+    BSM nodes and channels to them. Quantum connections are handed to
+    RouterNetTopo one at a time together with only the classical channels and
+    connections between the same two routers, instead of having it scan every
+    classical entry for every quantum connection.
+
+    The default static forwarding tables are built from one full Dijkstra run
+    per router instead of one run per ordered router pair. networkx settles a
+    target's path before it stops early, so the paths, and therefore the
+    tables, are identical to RouterNetTopo's.
+    '''
+    def _load(self, config: dict):
+        config = {key: list(value) if isinstance(value, list) else value for (key, value) in config.items()}
+        self._get_templates(config)
+        # quantum connections are only supported by sequential simulation so far
+        if not config[self.IS_PARALLEL]:
+            self._add_qconnections(config)
+        self._add_timeline(config)
+        self._map_bsm_routers(config)
+        self._add_nodes(config)
+        self._add_bsm_node_to_router()
+        self._add_qchannels(config)
+        self._add_cchannels(config)
+        self._add_cconnections(config)
+        self._generate_forwarding_table(config)
+
+    def _add_qconnections(self, config: dict):
+        channels = {}
+        for cc in config.get(self.ALL_C_CHANNEL, []):
+            channels.setdefault(frozenset((cc[self.SRC], cc[self.DST])), []).append(cc)
+        connections = {}
+        for cc in config.get(self.ALL_C_CONNECT, []):
+            connections.setdefault(frozenset((cc[self.CONNECT_NODE_1], cc[self.CONNECT_NODE_2])), []).append(cc)
+        config.setdefault(self.ALL_Q_CHANNEL, [])
+        config.setdefault(self.ALL_C_CHANNEL, [])
+        for q_connect in config.get(self.ALL_Q_CONNECT, []):
+            key = frozenset((q_connect[self.CONNECT_NODE_1], q_connect[self.CONNECT_NODE_2]))
+            matching = channels.get(key, [])
+            local = {self.ALL_NODE: config[self.ALL_NODE],
+                     self.ALL_Q_CONNECT: [q_connect],
+                     self.ALL_Q_CHANNEL: [],
+                     self.ALL_C_CHANNEL: list(matching),
+                     self.ALL_C_CONNECT: connections.get(key, [])}
+            RouterNetTopo._add_qconnections(self, local)
+            config[self.ALL_Q_CHANNEL].extend(local[self.ALL_Q_CHANNEL])
+            config[self.ALL_C_CHANNEL].extend(local[self.ALL_C_CHANNEL][len(matching):])
+
+    def _generate_forwarding_table(self, config: dict):
+        graph = Graph()
+        for node in config[Topo.ALL_NODE]:
+            if node[Topo.TYPE] == self.QUANTUM_ROUTER:
+                graph.add_node(node[Topo.NAME])
+        costs = {}
+        for qc in self.qchannels:
+            router, bsm = qc.sender.name, qc.receiver
+            if bsm not in costs:
+                costs[bsm] = [router, qc.distance]
+            else:
+                costs[bsm] = [router] + costs[bsm]
+                costs[bsm][-1] += qc.distance
+        graph.add_weighted_edges_from(costs.values())
+        paths = {name: single_source_dijkstra_path(graph, name) for name in graph.nodes}
+        for src in self.nodes[self.QUANTUM_ROUTER]:
+            for dst_name in graph.nodes:
+                if src.name == dst_name:
+                    continue
+                if dst_name > src.name:
+                    path = paths[src.name].get(dst_name)
+                else:
+                    path = paths[dst_name].get(src.name)
+                    path = path[::-1] if path is not None else None
+                if path is not None:
+                    # routing protocol locates at the bottom of the stack
+                    src.network_manager.protocol_stack[0].add_forwarding_rule(dst_name, path[1])
+
+
+_IN_MEMORY_LOAD = all(hasattr(RouterNetTopo, method) for method in (
+    "_get_templates", "_add_qconnections", "_add_timeline", "_map_bsm_routers", "_add_nodes",
+    "_add_bsm_node_to_router", "_add_qchannels", "_add_cchannels", "_add_cconnections", "_generate_forwarding_table"))
+_TMPFS = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+@instrumentation.timed
 def dict_to_topo(dictionary) -> RouterNetTopo:
-    with open("stuff.json", "w") as f:
-        json.dump(dictionary, f)
-    nw=RouterNetTopo("stuff.json")
-    os.remove("stuff.json")
+    if isinstance(dictionary, CompactTopology):
+        dictionary = dictionary.to_dict()
+    if _IN_MEMORY_LOAD:
+        return DictRouterNetTopo(dictionary)
+    return file_to_topo(dictionary, _TMPFS)
+
+def file_to_topo(dictionary, directory=None) -> RouterNetTopo:
+    # a unique file per call, so concurrent trials do not clobber each other
+    fd, path = tempfile.mkstemp(suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(dictionary, f)
+        nw=RouterNetTopo(path)
+    finally:
+        os.remove(path)
     return nw
-        
+
+@instrumentation.timed
 def set_parameters(topology: RouterNetTopo):
+    if isinstance(topology, CompactTopology):
+        # only the memory parameters enter the fidelity recurrence
+        view = get_routing_view(topology)
+        view.set_node_params(efficiency=np.full(len(view.names), DEFAULT_EFFICIENCY), fidelity=np.full(len(view.names), DEFAULT_FIDELITY))
+        return
     # set memory parameters
     MEMO_FREQ = 2e3
     MEMO_EXPIRE = 0
@@ -26,6 +142,7 @@ def set_parameters(topology: RouterNetTopo):
         memory_array.update_memory_params("coherence_time", MEMO_EXPIRE)
         memory_array.update_memory_params("efficiency", MEMO_EFFICIENCY)
         memory_array.update_memory_params("raw_fidelity", MEMO_FIDELITY)
+        instrumentation.count("get_components_by_type")
 
     # set detector parameters
     DETECTOR_EFFICIENCY = 0.9
@@ -36,6 +153,7 @@ def set_parameters(topology: RouterNetTopo):
         bsm.update_detectors_params("efficiency", DETECTOR_EFFICIENCY)
         bsm.update_detectors_params("count_rate", DETECTOR_COUNT_RATE)
         bsm.update_detectors_params("time_resolution", DETECTOR_RESOLUTION)
+        instrumentation.count("get_components_by_type")
     # set entanglement swapping parameters
     SWAP_SUCC_PROB = 0.90
     SWAP_DEGRADATION = 0.99
@@ -49,119 +167,208 @@ def set_parameters(topology: RouterNetTopo):
     for qc in topology.get_qchannels():
         qc.attenuation = ATTENUATION
         qc.frequency = QC_FREQ
+    invalidate_routing_view(topology)
 
 
+@instrumentation.timed
 def set_efficiency_xi(topology: RouterNetTopo, xi: float):
+    if isinstance(topology, CompactTopology):
+        # one draw per router, in the order RouterNetTopo lists them
+        view = get_routing_view(topology)
+        view.set_node_params(efficiency=[0.999 if random.random() < xi else 0.8 for _ in view.names])
+        return
     for node in topology.get_nodes_by_type(RouterNetTopo.QUANTUM_ROUTER):
         MEMO_EFFICIENCY = 0.999 if random.random() < xi else 0.8
         memory_array = node.get_components_by_type("MemoryArray")[0]
         memory_array.update_memory_params("efficiency", MEMO_EFFICIENCY)
+        instrumentation.count("get_components_by_type")
+    invalidate_routing_view(topology)
+@instrumentation.timed
 def set_efficiency_alpha(topology: RouterNetTopo, alpha: float):
+    if isinstance(topology, CompactTopology):
+        view = get_routing_view(topology)
+        view.set_node_params(efficiency=[math.log(random.uniform(math.e**(0.8*alpha), math.e**(0.999*alpha)))/alpha for _ in view.names])
+        return
     for node in topology.get_nodes_by_type(RouterNetTopo.QUANTUM_ROUTER):
         MEMO_EFFICIENCY = math.log(random.uniform(math.e**(0.8*alpha), math.e**(0.999*alpha)))/alpha
         memory_array = node.get_components_by_type("MemoryArray")[0]
         memory_array.update_memory_params("efficiency", MEMO_EFFICIENCY)
+        instrumentation.count("get_components_by_type")
+    invalidate_routing_view(topology)
+
+@instrumentation.timed
+def draw_efficiencies(trials: int, routers: int, xi=0.9, alpha=None, rng=None) -> np.ndarray:
+    '''
+    Memory efficiencies of many trials at once, a (trials, routers) array
+    whose rows follow set_efficiency_xi, or set_efficiency_alpha when alpha
+    is given. rng is anything numpy.random.default_rng accepts.
+    '''
+    rng = np.random.default_rng(rng)
+    if alpha is None:
+        return np.where(rng.random((trials, routers)) < xi, 0.999, 0.8)
+    return np.log(rng.uniform(math.e**(0.8*alpha), math.e**(0.999*alpha), (trials, routers)))/alpha
 
 
 def clear_forwarding_tables(topology: RouterNetTopo):
+    view = getattr(topology, "routing_view", None)
+    if view is not None:
+        view.clear_next_hops()
+    if isinstance(topology, CompactTopology):
+        return
     for src in topology.nodes[topology.QUANTUM_ROUTER]:
         routing_protocol = src.network_manager.protocol_stack[0]
         routing_protocol.forwarding_table = {}
 
+@instrumentation.timed
+def push_forwarding_tables(topology: RouterNetTopo, view: RoutingView = None, routers=None):
+    '''
+    Copies view.next_hops into the SeQUeNCe forwarding tables, replacing
+    each router's table in one assignment: every router's, or those of the
+    router ids in routers. A CompactTopology has no tables to push to.
+    '''
+    view = get_routing_view(topology, view)
+    if not view.routers:
+        return
+    for (name, table) in forwarding.tables(view.next_hops, view.names, routers).items():
+        view.routing_protocol(name).forwarding_table = table
 
-def gen_tables_shortest_path(topology: RouterNetTopo):
-    graph = Graph()
-    for node in topology.get_nodes_by_type(RouterNetTopo.QUANTUM_ROUTER):     
-        fidelity= node.get_components_by_type("MemoryArray")[0][0].raw_fidelity
-        efficiency= node.get_components_by_type("MemoryArray")[0][0].efficiency
-        graph.add_node(node.name, fidelity=fidelity, efficiency=efficiency)
-    costs = {}
-    for qc in topology.qchannels:
-        router, bsm = qc.sender.name, qc.receiver
-        if bsm not in costs:
-            costs[bsm] = [router, qc.distance]
-        else:
-            costs[bsm] = [router] + costs[bsm]
-            costs[bsm][-1] += qc.distance
-    graph.add_weighted_edges_from(costs.values()) 
-    for src in topology.nodes[topology.QUANTUM_ROUTER]:
-        for dst_name in graph.nodes:
-            if src.name == dst_name:
+
+def _choose_path(view: RoutingView, paths, highest=False):
+    paths = list(paths)
+    instrumentation.count("candidate_paths", len(paths))
+    if not paths:
+        return None
+    chosen = select_path(view.fidelity_table.score([view.path_indices(p) for p in paths]), highest)
+    return None if chosen is None else paths[chosen]
+
+
+@instrumentation.timed
+def gen_tables_shortest_path(topology: RouterNetTopo, view: RoutingView = None, push=True, destinations=None):
+    '''
+    Forwarding rule of every router towards every other router, or towards
+    the router names in destinations: the next hop of its highest fidelity
+    shortest path, if that fidelity is above the threshold. One BFS and DAG
+    pass (shortest_path_labels) per destination gives the rules of all
+    routers towards it. Rules go to view.next_hops, and with push to the
+    SeQUeNCe tables as well.
+    '''
+    view = get_routing_view(topology, view)
+    targets = _targets(view, destinations)
+    if not view.fidelity_table.monotone:
+        _gen_tables_shortest_path_pairs(topology, view, targets)
+    else:
+        for target in targets:
+            _install_labels(view, target, *shortest_path_labels(view.fidelity_table, view.adjacency, target))
+    if push:
+        push_forwarding_tables(topology, view)
+
+def _install_labels(view: RoutingView, target, labels, hops):
+    # a rule towards target wherever the labelled path passes the threshold
+    hops = np.array(hops)
+    passes = (hops >= 0) & (0.25 + (INITIAL_FIDELITY - 0.25)*np.array(labels) > FIDELITY_THRESHOLD)
+    if passes.any():
+        view.next_hops[passes, target] = hops[passes]
+    instrumentation.count("forwarding_rules", int(np.count_nonzero(passes)))
+
+def _targets(view: RoutingView, destinations) -> list:
+    # router ids of destinations, every router's when it is None
+    if destinations is None:
+        return list(range(len(view.names)))
+    return [view.index[destination] for destination in destinations]
+
+def _gen_tables_shortest_path_pairs(topology: RouterNetTopo, view: RoutingView, targets):
+    # first shortest path above the threshold, pair by pair; used when the
+    # fidelity factors are not monotone
+    graph = view.graph
+    for src_name in view.names:
+        for dst_name in [view.names[target] for target in targets]:
+            if src_name == dst_name:
                 continue
             try:
-                if dst_name > src.name:
-                    paths = all_shortest_paths(graph, src.name, dst_name, weight=None)
+                if dst_name > src_name:
+                    paths = all_shortest_paths(graph, src_name, dst_name, weight=None)
                 else:
-                    paths = list(map(lambda l: l[::-1], all_shortest_paths(graph, dst_name, src.name, weight=None)))
-                for path in paths:
-                    resulting_fidelity = 0.975
-                    for node in path[1:-1]:
-                        resulting_fidelity = (resulting_fidelity-0.25)* ((4*graph.nodes[node]["efficiency"]**2 - 1)/3) * ((4*graph.nodes[node]["fidelity"] - 1)/3) + 0.25
-                    if resulting_fidelity > 0.53:
-                        next_hop = path[1]
-                        # routing protocol locates at the bottom of the stack
-                        routing_protocol = src.network_manager.protocol_stack[0]  # guarantee that [0] is the routing protocol?
-                        routing_protocol.add_forwarding_rule(dst_name, next_hop)
-                        break
+                    paths = list(map(lambda l: l[::-1], all_shortest_paths(graph, dst_name, src_name, weight=None)))
+                paths = list(paths)
+                chosen = first_above_threshold(view.fidelity_table.score([view.path_indices(path) for path in paths]))
+                if chosen is not None:
+                    next_hop = paths[chosen][1]
+                    view.next_hops[view.index[src_name], view.index[dst_name]] = view.index[next_hop]
+                    instrumentation.count("forwarding_rules")
             except exception.NetworkXNoPath:
                 pass
 
-def gen_tables_efficiency_cost(topology: RouterNetTopo, e_max=0.999, e_min=0.8):
-    graph = Graph()
-    for node in topology.get_nodes_by_type(RouterNetTopo.QUANTUM_ROUTER):     
-        fidelity= node.get_components_by_type("MemoryArray")[0][0].raw_fidelity
-        efficiency= node.get_components_by_type("MemoryArray")[0][0].efficiency
-        graph.add_node(node.name, fidelity=fidelity, efficiency=efficiency)
-    costs = {}
-    for qc in topology.qchannels:
-        router, bsm = qc.sender.name, qc.receiver
-        if bsm not in costs:
-            costs[bsm] = [router, qc.distance]
-        else:
-            costs[bsm] = [router] + costs[bsm]
-            costs[bsm][-1] += qc.distance
-    graph.add_weighted_edges_from(costs.values()) 
-    for src in topology.nodes[topology.QUANTUM_ROUTER]:
-        for dst_name in graph.nodes:
-            if src.name == dst_name:
+def efficiency_weights(efficiency, e_max=0.999, e_min=0.8) -> np.ndarray:
+    # cost of a hop into a router of the given memory efficiency
+    return np.exp(10*(np.asarray(efficiency, dtype=float) - e_min)/(e_max-e_min))
+
+def efficiency_cost_distances(view: RoutingView, weights, targets=None) -> np.ndarray:
+    '''
+    distances[i][u] is the least cost of a path from router u to router
+    targets[i], every router by default, where a hop into router v costs
+    weights[v]. One Dijkstra per destination over the reversed graph, all
+    run by scipy.
+    '''
+    n = len(view.names)
+    rows = np.repeat(np.arange(n), [len(neighbours) for neighbours in view.adjacency])
+    cols = np.fromiter(chain.from_iterable(view.adjacency), dtype=np.intp, count=len(rows))
+    weights = np.asarray(weights, dtype=float)
+    # a hop u -> v, costing weights[v], is the edge v -> u of the reversed graph
+    reverse = csr_matrix((weights[cols], (cols, rows)), shape=(n, n))
+    return dijkstra(reverse, directed=True, indices=targets)
+
+@instrumentation.timed
+def gen_tables_efficiency_cost(topology: RouterNetTopo, e_max=0.999, e_min=0.8, view: RoutingView = None, push=True, destinations=None):
+    '''
+    Forwarding rule of every router towards every other router, or towards
+    the router names in destinations, along the least-cost paths, a hop into a router costing
+    e**(10*(efficiency - e_min)/(e_max - e_min)): the next hop of the highest
+    fidelity least-cost path, if that fidelity is above the threshold.
+    Rules go to view.next_hops, and with push to the SeQUeNCe tables too.
+    '''
+    view = get_routing_view(topology, view)
+    targets = _targets(view, destinations)
+    if not view.fidelity_table.monotone:
+        _gen_tables_efficiency_cost_pairs(topology, e_max, e_min, view, targets)
+    elif targets:
+        weights = efficiency_weights(view.efficiency, e_max, e_min)
+        distances = efficiency_cost_distances(view, weights, targets)
+        weights = weights.tolist()
+        for (target, distance) in zip(targets, distances):
+            _install_labels(view, target, *cost_path_labels(view.fidelity_table, view.adjacency, weights, distance.tolist(), target))
+    if push:
+        push_forwarding_tables(topology, view)
+
+def _gen_tables_efficiency_cost_pairs(topology: RouterNetTopo, e_max, e_min, view: RoutingView, targets):
+    # first least-cost path above the threshold, pair by pair; used when the
+    # fidelity factors are not monotone
+    graph = view.graph
+    for src_name in view.names:
+        for dst_name in [view.names[target] for target in targets]:
+            if src_name == dst_name:
                 continue
             try:
                 def cost(x, y, edge_dict):
-                        math.e**(10*(graph.nodes[y]["efficiency"] - e_min)/(e_max-e_min))
+                        return math.e**(10*(graph.nodes[y]["efficiency"] - e_min)/(e_max-e_min))
                 paths=None
-                if dst_name > src.name:
-                    paths = all_shortest_paths(graph, src.name, dst_name, weight=cost)
+                if dst_name > src_name:
+                    paths = all_shortest_paths(graph, src_name, dst_name, weight=cost)
                 else:
-                    paths = list(map(lambda l: l[::-1], all_shortest_paths(graph, dst_name, src.name, weight=cost)))
-                for path in paths:
-                    resulting_fidelity = 0.975
-                    for node in path[1:-1]:
-                        resulting_fidelity = (resulting_fidelity-0.25)* ((4*graph.nodes[node]["efficiency"]**2 - 1)/3) * ((4*graph.nodes[node]["fidelity"] - 1)/3) + 0.25
-                    if resulting_fidelity > 0.53:
-                        next_hop = path[1]
-                        # routing protocol locates at the bottom of the stack
-                        routing_protocol = src.network_manager.protocol_stack[0]  # guarantee that [0] is the routing protocol?
-                        routing_protocol.add_forwarding_rule(dst_name, next_hop)
-                        break
+                    paths = list(map(lambda l: l[::-1], all_shortest_paths(graph, dst_name, src_name, weight=cost)))
+                paths = list(paths)
+                chosen = first_above_threshold(view.fidelity_table.score([view.path_indices(path) for path in paths]))
+                if chosen is not None:
+                    next_hop = paths[chosen][1]
+                    view.next_hops[view.index[src_name], view.index[dst_name]] = view.index[next_hop]
+                    instrumentation.count("forwarding_rules")
             except exception.NetworkXNoPath:
                 pass
 
 
-def gen_tables_kshortest_path(topology: RouterNetTopo, source, destination, k = 10):
-    graph = Graph()
-    for node in topology.get_nodes_by_type(RouterNetTopo.QUANTUM_ROUTER):     
-        fidelity= node.get_components_by_type("MemoryArray")[0][0].raw_fidelity
-        efficiency= node.get_components_by_type("MemoryArray")[0][0].efficiency
-        graph.add_node(node.name, fidelity=fidelity, efficiency=efficiency)
-    costs = {}
-    for qc in topology.qchannels:
-        router, bsm = qc.sender.name, qc.receiver
-        if bsm not in costs:
-            costs[bsm] = [router, qc.distance]
-        else:
-            costs[bsm] = [router] + costs[bsm]
-            costs[bsm][-1] += qc.distance
-    graph.add_weighted_edges_from(costs.values())
+@instrumentation.timed
+def gen_tables_kshortest_path(topology: RouterNetTopo, source, destination, k = 10, view: RoutingView = None, push=True):
+    view = get_routing_view(topology, view)
+    graph = view.graph
     if source==destination:
         return None
     try:
@@ -170,87 +377,31 @@ def gen_tables_kshortest_path(topology: RouterNetTopo, source, destination, k =
             paths=shortest_simple_paths(graph, source, destination, weight = None)
         else:
             paths=map(lambda l: l[::-1], shortest_simple_paths(graph, destination, source, weight = None))
-        final_path = None
-        min_fidelity = 10
-        for (i, p) in enumerate(paths):
-            if i>=k:
-                break
-            resulting_fidelity = 0.975
-            for node in p[1:-1]:
-                resulting_fidelity = (resulting_fidelity-0.25)* ((4*graph.nodes[node]["efficiency"]**2 - 1)/3) * ((4*graph.nodes[node]["fidelity"] - 1)/3) + 0.25
-            if resulting_fidelity < min_fidelity  and resulting_fidelity > 0.53:
-                min_fidelity = resulting_fidelity
-                final_path = p
+        final_path = _choose_path(view, islice(paths, k))
         if final_path == None:
             raise exception.NetworkXNoPath
-        for (i, node_name) in enumerate(final_path[:-1]):
-            for node in topology.get_nodes_by_type(RouterNetTopo.QUANTUM_ROUTER):
-                if node.name == node_name:
-                    node.network_manager.protocol_stack[0].update_forwarding_rule(destination, final_path[i+1])
+        install_paths(topology, {(source, destination): final_path}, view, push)
     except exception.NetworkXNoPath:
         pass
 
-def gen_tables_kxshortest_path(topology: RouterNetTopo, source, destination, k = 10, x=1):
-    graph = Graph()
-    for node in topology.get_nodes_by_type(RouterNetTopo.QUANTUM_ROUTER):     
-        fidelity= node.get_components_by_type("MemoryArray")[0][0].raw_fidelity
-        efficiency= node.get_components_by_type("MemoryArray")[0][0].efficiency
-        graph.add_node(node.name, fidelity=fidelity, efficiency=efficiency)
-    costs = {}
-    for qc in topology.qchannels:
-        router, bsm = qc.sender.name, qc.receiver
-        if bsm not in costs:
-            costs[bsm] = [router, qc.distance]
-        else:
-            costs[bsm] = [router] + costs[bsm]
-            costs[bsm][-1] += qc.distance
-    graph.add_weighted_edges_from(costs.values())
+@instrumentation.timed
+def gen_tables_kxshortest_path(topology: RouterNetTopo, source, destination, k = 10, x=1, view: RoutingView = None, push=True):
+    view = get_routing_view(topology, view)
+    graph = view.graph
     if source==destination:
         return None
     try:
-        paths=None
-        min_length=None
-        if destination > source:
-            paths=shortest_simple_paths(graph, source, destination, weight = None)
-            min_length=shortest_path_length(graph, source, destination, weight = None)
-        else:
-            paths=map(lambda l: l[::-1], shortest_simple_paths(graph, destination, source, weight = None))
-            min_length=shortest_path_length(graph, destination, source, weight = None)
-        final_path = None
-        min_fidelity = 10
-        for (i, p) in enumerate(paths):
-            if i>=k or abs(len(p) - (min_length+1)) > x:
-                break
-            resulting_fidelity = 0.975
-            for node in p[1:-1]:
-                resulting_fidelity = (resulting_fidelity-0.25)* ((4*graph.nodes[node]["efficiency"]**2 - 1)/3) * ((4*graph.nodes[node]["fidelity"] - 1)/3) + 0.25
-            if resulting_fidelity < min_fidelity  and resulting_fidelity > 0.53:
-                min_fidelity = resulting_fidelity
-                final_path = p
+        final_path = _choose_path(view, islice(_bounded_candidate_paths(graph, source, destination, x), k))
         if final_path == None:
             raise exception.NetworkXNoPath
-        for (i, node_name) in enumerate(final_path[:-1]):
-            for node in topology.get_nodes_by_type(RouterNetTopo.QUANTUM_ROUTER):
-                if node.name == node_name:
-                    node.network_manager.protocol_stack[0].update_forwarding_rule(destination, final_path[i+1])
+        install_paths(topology, {(source, destination): final_path}, view, push)
     except exception.NetworkXNoPath:
         pass
 
-def gen_tables_kshortest_path_qos(topology: RouterNetTopo, source, destination, k = 10, is_high=is_high):
-    graph = Graph()
-    for node in topology.get_nodes_by_type(RouterNetTopo.QUANTUM_ROUTER):     
-        fidelity= node.get_components_by_type("MemoryArray")[0][0].raw_fidelity
-        efficiency= node.get_components_by_type("MemoryArray")[0][0].efficiency
-        graph.add_node(node.name, fidelity=fidelity, efficiency=efficiency)
-    costs = {}
-    for qc in topology.qchannels:
-        router, bsm = qc.sender.name, qc.receiver
-        if bsm not in costs:
-            costs[bsm] = [router, qc.distance]
-        else:
-            costs[bsm] = [router] + costs[bsm]
-            costs[bsm][-1] += qc.distance
-    graph.add_weighted_edges_from(costs.values())
+@instrumentation.timed
+def gen_tables_kshortest_path_qos(topology: RouterNetTopo, source, destination, k = 10, is_high=is_high, view: RoutingView = None, push=True):
+    view = get_routing_view(topology, view)
+    graph = view.graph
     if source==destination:
         return None
     try:
@@ -259,94 +410,223 @@ def gen_tables_kshortest_path_qos(topology: RouterNetTopo, source, destination,
             paths=shortest_simple_paths(graph, source, destination, weight = None)
         else:
             paths=map(lambda l: l[::-1], shortest_simple_paths(graph, destination, source, weight = None))
-        final_path=None
-        if is_high(destination):
-            min_fidelity = 10
-            for (i, p) in enumerate(paths):
-                if i>=k:
-                    break
-                resulting_fidelity = 0.975
-                for node in p[1:-1]:
-                    resulting_fidelity = (resulting_fidelity-0.25)* ((4*graph.nodes[node]["efficiency"]**2 - 1)/3) * ((4*graph.nodes[node]["fidelity"] - 1)/3) + 0.25
-                if resulting_fidelity < min_fidelity  and resulting_fidelity > 0.53:
-                    min_fidelity = resulting_fidelity
-                    final_path = p
-        else:
-            max_fidelity = -1
-            for (i, p) in enumerate(paths):
-                if i>=k:
-                    break
-                resulting_fidelity = 0.975
-                for node in p[1:-1]:
-                    resulting_fidelity = (resulting_fidelity-0.25)* ((4*graph.nodes[node]["efficiency"]**2 - 1)/3) * ((4*graph.nodes[node]["fidelity"] - 1)/3) + 0.25
-                if resulting_fidelity > max_fidelity  and resulting_fidelity > 0.53:
-                    max_fidelity = resulting_fidelity
-                    final_path = p
-                
+        final_path = _choose_path(view, islice(paths, k), highest=not is_high(destination))
         if final_path == None:
             raise exception.NetworkXNoPath
-        for (i, node_name) in enumerate(final_path[:-1]):
-            for node in topology.get_nodes_by_type(RouterNetTopo.QUANTUM_ROUTER):
-                if node.name == node_name:
-                    node.network_manager.protocol_stack[0].update_forwarding_rule(destination, final_path[i+1])
+        install_paths(topology, {(source, destination): final_path}, view, push)
     except exception.NetworkXNoPath:
         pass
 
-def gen_tables_kxshortest_path_qos(topology: RouterNetTopo, source, destination, k = 10, x=1, is_high=is_high):
-    graph = Graph()
-    for node in topology.get_nodes_by_type(RouterNetTopo.QUANTUM_ROUTER):     
-        fidelity= node.get_components_by_type("MemoryArray")[0][0].raw_fidelity
-        efficiency= node.get_components_by_type("MemoryArray")[0][0].efficiency
-        graph.add_node(node.name, fidelity=fidelity, efficiency=efficiency)
-    costs = {}
-    for qc in topology.qchannels:
-        router, bsm = qc.sender.name, qc.receiver
-        if bsm not in costs:
-            costs[bsm] = [router, qc.distance]
-        else:
-            costs[bsm] = [router] + costs[bsm]
-            costs[bsm][-1] += qc.distance
-    graph.add_weighted_edges_from(costs.values())
+@instrumentation.timed
+def gen_tables_kxshortest_path_qos(topology: RouterNetTopo, source, destination, k = 10, x=1, is_high=is_high, view: RoutingView = None, push=True):
+    view = get_routing_view(topology, view)
     if source==destination:
         return None
+    final_path = qos_pair_path(view, source, destination, k, x, is_high)
+    if final_path is not None:
+        install_paths(topology, {(source, destination): final_path}, view, push)
+
+
+def bounded_simple_paths(graph, source, target, x=0, distances=None):
+    '''
+    Simple paths from source to target at most x hops longer than the
+    shortest one, shortest first.
+
+    distances maps every node to its hop distance to target, as given by
+    single_source_shortest_path_length(graph, target), and is computed when
+    not passed. Paths of each length are found by a depth-first search that
+    drops any branch which can no longer reach target within that length,
+    so with x=0 it only walks the shortest-path DAG. Paths of equal length
+    come in depth-first order of the graph's adjacency lists.
+    '''
+    if distances is None:
+        distances = single_source_shortest_path_length(graph, target)
+    if source not in distances:
+        return
+    if source == target:
+        yield [source]
+        return
+    shortest = distances[source]
+    for length in range(shortest, shortest + x + 1):
+        path = [source]
+        on_path = {source}
+        stack = [iter(graph[source])]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                on_path.discard(path.pop())
+                continue
+            hops = len(path)
+            if child in on_path or child not in distances or hops + distances[child] > length:
+                continue
+            if child == target:
+                if hops == length:
+                    yield path + [child]
+                continue
+            path.append(child)
+            on_path.add(child)
+            stack.append(iter(graph[child]))
+
+def _candidate_paths(graph, source, destination):
+    if destination > source:
+        return shortest_simple_paths(graph, source, destination, weight = None)
+    return map(lambda l: l[::-1], shortest_simple_paths(graph, destination, source, weight = None))
+
+def _bounded_candidate_paths(graph, source, destination, x, distances=None):
+    # same orientation as _candidate_paths; distances are to the search target
+    if destination > source:
+        return bounded_simple_paths(graph, source, destination, x, distances)
+    return map(lambda l: l[::-1], bounded_simple_paths(graph, destination, source, x, distances))
+
+def qos_pair_path(view: RoutingView, source, destination, k, x, is_high, searches=None):
+    '''
+    The kx QoS choice for one pair, found by qos_search instead of scoring
+    every candidate: the highest fidelity path for a low priority
+    destination, the lowest one above the threshold for a high priority one.
+
+    The search covers every path of at most d+x hops rather than the first k
+    of them. searches holds the hop distances and completion bounds of every
+    search target, shared by the pairs routed together. Falls back to
+    enumerating k candidates when the fidelity factors are not monotone.
+    '''
+    highest = not is_high(destination)
+    if not view.fidelity_table.monotone:
+        return _choose_path(view, islice(_bounded_candidate_paths(view.graph, source, destination, x), k), highest)
+    (start, target) = (source, destination) if destination > source else (destination, source)
+    (start, target) = (view.index[start], view.index[target])
+    if searches is None:
+        searches = {}
+    if target not in searches:
+        searches[target] = [hop_distances(view.adjacency, target), None]
+    search = searches[target]
+    distances = search[0]
+    if distances[start] < 0:
+        return None
+    max_hops = distances[start] + x
+    if not highest and (search[1] is None or len(search[1][0]) <= max_hops):
+        search[1] = completion_bounds(view.fidelity_table, view.adjacency, target, max_hops)
+    path = qos_path(view.fidelity_table, view.adjacency, start, target, highest, max_hops, distances, search[1])
+    if path is None:
+        return None
+    path = [view.names[i] for i in path]
+    return path if destination > source else path[::-1]
+
+def _qos_route_all_pairs(topology: RouterNetTopo, sources, destinations, k, x, is_high, view: RoutingView, push=True):
+    # _route_all_pairs for the kx QoS strategies, one search setup per target
+    view = get_routing_view(topology, view)
+    searches = {}
+    final_paths = {}
+    for source in sources:
+        for destination in destinations:
+            if source == destination:
+                continue
+            final_paths[(source, destination)] = qos_pair_path(view, source, destination, k, x, is_high, searches)
+    install_paths(topology, final_paths, view, push)
+    return final_paths
+
+def _route_all_pairs(topology: RouterNetTopo, sources, destinations, k, x, is_high, view: RoutingView, push=True, path_cache=None):
+    '''
+    Chooses the path of every (source, destination) pair the way the per-pair
+    gen_tables_k* functions do, then writes all forwarding rules in one sweep.
+
+    With x set, candidates come from bounded_simple_paths with one BFS per
+    search target shared by all its pairs. All candidates of all pairs are
+    scored in a single FidelityTable call, and the min/max fidelity choice
+    is made per pair with select_paths. is_high
+    is None for the strategies that always take the minimum fidelity.
+    Returns {(source, destination): path or None}. Candidates go through
+    path_cache, a PathCache, if given, so trials on one structure
+    enumerate them once.
+
+    The kx QoS strategies go to _qos_route_all_pairs, which searches for
+    the QoS-optimal path directly.
+    '''
+    view = get_routing_view(topology, view)
+    if is_high is not None and x is not None:
+        return _qos_route_all_pairs(topology, sources, destinations, k, x, is_high, view, push)
+    distances = {}
+    pairs = []
+    candidates = []
+    groups = []
+    for source in sources:
+        for destination in destinations:
+            if source == destination:
+                continue
+            paths = candidate_indices(view, source, destination, k, x, distances, path_cache)
+            candidates.extend(paths)
+            groups.extend([len(pairs)] * len(paths))
+            pairs.append((source, destination))
+
+    instrumentation.count("candidate_paths", len(candidates))
+    highest = [is_high is not None and not is_high(destination) for (_, destination) in pairs]
+    fidelities = view.fidelity_table.score(candidates)
+    chosen = select_paths(fidelities, groups, len(pairs), highest)
+    final_paths = {}
+    for (pair, i) in zip(pairs, chosen):
+        final_paths[pair] = [view.names[u] for u in candidates[i]] if i >= 0 else None
+    install_paths(topology, final_paths, view, push)
+    return final_paths
+
+def candidate_indices(view: RoutingView, source, destination, k, x, distances, path_cache=None) -> list:
+    '''
+    The first k candidates of a pair as router id lists: Yen's order when
+    x is None, bounded_simple_paths otherwise. distances holds the hop
+    distances of every search target, shared by the pairs routed together.
+    Goes through path_cache, a PathCache, if given.
+    '''
+    if path_cache is not None:
+        key = pair_key(view, source, destination, k, x)
+        paths = path_cache.get(key)
+        if paths is not None:
+            return paths
+    graph = view.graph
     try:
-        paths=None
-        min_length=None
-        if destination > source:
-            paths=shortest_simple_paths(graph, source, destination, weight = None)
-            min_length=shortest_path_length(graph, source, destination, weight = None)
-        else:
-            paths=map(lambda l: l[::-1], shortest_simple_paths(graph, destination, source, weight = None))
-            min_length=shortest_path_length(graph, destination, source, weight = None)
-        final_path=None
-        if is_high(destination):
-            min_fidelity = 10
-            for (i, p) in enumerate(paths):
-                if i>=k or abs(len(p) - (min_length+1)) > x:
-                    break
-                resulting_fidelity = 0.975
-                for node in p[1:-1]:
-                    resulting_fidelity = (resulting_fidelity-0.25)* ((4*graph.nodes[node]["efficiency"]**2 - 1)/3) * ((4*graph.nodes[node]["fidelity"] - 1)/3) + 0.25
-                if resulting_fidelity < min_fidelity  and resulting_fidelity > 0.53:
-                    min_fidelity = resulting_fidelity
-                    final_path = p
+        if x is None:
+            paths = list(islice(_candidate_paths(graph, source, destination), k))
         else:
-            max_fidelity = -1
-            for (i, p) in enumerate(paths):
-                if i>=k or abs(len(p) - (min_length+1)) > x:
-                    break
-                resulting_fidelity = 0.975
-                for node in p[1:-1]:
-                    resulting_fidelity = (resulting_fidelity-0.25)* ((4*graph.nodes[node]["efficiency"]**2 - 1)/3) * ((4*graph.nodes[node]["fidelity"] - 1)/3) + 0.25
-                if resulting_fidelity > max_fidelity  and resulting_fidelity > 0.53:
-                    max_fidelity = resulting_fidelity
-                    final_path = p
-                
-        if final_path == None:
-            raise exception.NetworkXNoPath
-        for (i, node_name) in enumerate(final_path[:-1]):
-            for node in topology.get_nodes_by_type(RouterNetTopo.QUANTUM_ROUTER):
-                if node.name == node_name:
-                    node.network_manager.protocol_stack[0].update_forwarding_rule(destination, final_path[i+1])
+            target = max(source, destination)
+            if target not in distances:
+                distances[target] = single_source_shortest_path_length(graph, target)
+            paths = list(islice(_bounded_candidate_paths(graph, source, destination, x, distances[target]), k))
     except exception.NetworkXNoPath:
-        pass
+        paths = []
+    paths = [view.path_indices(path) for path in paths]
+    if path_cache is not None:
+        path_cache.put(key, paths)
+    return paths
+
+@instrumentation.timed
+def install_paths(topology: RouterNetTopo, final_paths: dict, view: RoutingView = None, push=True):
+    '''
+    Writes the rules along every chosen path into view.next_hops, in order,
+    so a later path overrides an earlier one at a shared router. With push
+    the tables of the routers written to are pushed to SeQUeNCe.
+    '''
+    view = get_routing_view(topology, view)
+    written = set()
+    for final_path in final_paths.values():
+        if final_path is None:
+            continue
+        path = view.path_indices(final_path)
+        forwarding.write_path(view.next_hops, path)
+        written.update(path[:-1])
+        instrumentation.count("forwarding_rules", len(final_path) - 1)
+    if push and written:
+        push_forwarding_tables(topology, view, sorted(written))
+
+@instrumentation.timed
+def gen_tables_kshortest_path_all(topology: RouterNetTopo, sources, destinations, k = 10, view: RoutingView = None, push=True, path_cache=None) -> dict:
+    return _route_all_pairs(topology, sources, destinations, k, None, None, view, push, path_cache)
+
+@instrumentation.timed
+def gen_tables_kxshortest_path_all(topology: RouterNetTopo, sources, destinations, k = 10, x=1, view: RoutingView = None, push=True, path_cache=None) -> dict:
+    return _route_all_pairs(topology, sources, destinations, k, x, None, view, push, path_cache)
+
+@instrumentation.timed
+def gen_tables_kshortest_path_qos_all(topology: RouterNetTopo, sources, destinations, k = 10, is_high=is_high, view: RoutingView = None, push=True, path_cache=None) -> dict:
+    return _route_all_pairs(topology, sources, destinations, k, None, is_high, view, push, path_cache)
+
+@instrumentation.timed
+def gen_tables_kxshortest_path_qos_all(topology: RouterNetTopo, sources, destinations, k = 10, x=1, is_high=is_high, view: RoutingView = None, push=True, path_cache=None) -> dict:
+    return _route_all_pairs(topology, sources, destinations, k, x, is_high, view, push, path_cache)
@@ -0,0 +1,116 @@
+import sqlite3
+from collections import OrderedDict
+from itertools import chain
+import numpy as np
+import instrumentation
+
+def pair_key(view, source, destination, k, x) -> tuple:
+    '''
+    Cache key of the first k candidates of a pair: the view's structure_key,
+    the router ids, k, x, and which end the search starts from. That end is
+    picked by name, so it is part of the key.
+    '''
+    return (view.structure_key(), view.index[source], view.index[destination], destination > source, k, x)
+
+
+class PathCache:
+    '''
+    Candidate paths of (source, destination) pairs, shared by every trial on
+    the same structure.
+
+    Enumerating candidates only looks at the router graph and the adjacency
+    order that breaks its ties, never at node parameters or names. An entry
+    keyed by pair_key can therefore be scored again on any later trial whose
+    view has the same structure_key, whatever its efficiencies or "hd"
+    labels. Paths are stored as router ids: one int32 array of all paths
+    concatenated, and an array of offsets.
+
+    At most max_bytes of arrays stay in memory, least recently used first
+    out. With spill, the path of a SQLite file, every entry is also written
+    there, batch_size at a time, and a memory miss looks there next. Several
+    processes can share one file, and a later run starts warm.
+
+    Pass it as path_cache to evaluate_strategies, the gen_tables_*_all
+    functions or DynamicRouter, and their candidate enumeration goes
+    through it. As a context manager it is closed on exit, like a
+    ResultStore. hits and misses count lookups.
+    '''
+    def __init__(self, max_bytes=64 << 20, spill=None, batch_size=64):
+        self.max_bytes = max_bytes
+        self.spill = spill
+        self.batch_size = batch_size
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.pending = []
+        self.connection = None
+        if spill is not None:
+            self.connection = sqlite3.connect(spill)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS paths (key TEXT PRIMARY KEY, flat BLOB, offsets BLOB)")
+            self.connection.commit()
+
+    def get(self, key):
+        '''
+        The cached paths of key as lists of router ids, or None.
+        '''
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        elif self.connection is not None:
+            self.flush()
+            row = self.connection.execute("SELECT flat, offsets FROM paths WHERE key = ?", (_text(key),)).fetchone()
+            if row is not None:
+                entry = (np.frombuffer(row[0], dtype=np.int32), np.frombuffer(row[1], dtype=np.int32))
+                self._keep(key, entry)
+        if entry is None:
+            self.misses += 1
+            instrumentation.count("path_cache_misses")
+            return None
+        self.hits += 1
+        instrumentation.count("path_cache_hits")
+        (flat, offsets) = entry
+        ids = flat.tolist()
+        bounds = offsets.tolist()
+        return [ids[bounds[i]:bounds[i+1]] for i in range(len(bounds) - 1)]
+
+    def put(self, key, paths):
+        flat = np.fromiter(chain.from_iterable(paths), dtype=np.int32)
+        offsets = np.cumsum([0] + [len(path) for path in paths], dtype=np.int32)
+        self._keep(key, (flat, offsets))
+        if self.connection is not None:
+            self.pending.append((_text(key), flat.tobytes(), offsets.tobytes()))
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+
+    def _keep(self, key, entry):
+        self.entries[key] = entry
+        self.bytes += entry[0].nbytes + entry[1].nbytes
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            (_, (flat, offsets)) = self.entries.popitem(last=False)
+            self.bytes -= flat.nbytes + offsets.nbytes
+
+    def flush(self):
+        if self.pending:
+            with self.connection:
+                self.connection.executemany("INSERT OR IGNORE INTO paths VALUES (?, ?, ?)", self.pending)
+            self.pending = []
+
+    def close(self):
+        if self.connection is not None:
+            self.flush()
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def _text(key) -> str:
+    return "|".join(map(str, key))
@@ -0,0 +1,276 @@
+import heapq
+import math
+from fidelity import INITIAL_FIDELITY, FIDELITY_THRESHOLD, TIE_TOLERANCE, FidelityTable
+
+# a path passes the threshold when the log of its repeater product is above this
+LOG_THRESHOLD = math.log((FIDELITY_THRESHOLD - 0.25)/(INITIAL_FIDELITY - 0.25))
+
+
+def hop_distances(adjacency, target) -> list:
+    '''
+    Hop distance of every node to target by BFS, -1 where unreachable.
+    adjacency[u] lists the neighbours of node u.
+    '''
+    distances = [-1] * len(adjacency)
+    distances[target] = 0
+    frontier = [target]
+    while frontier:
+        next_frontier = []
+        for u in frontier:
+            for v in adjacency[u]:
+                if distances[v] < 0:
+                    distances[v] = distances[u] + 1
+                    next_frontier.append(v)
+        frontier = next_frontier
+    return distances
+
+
+def shortest_path_labels(table: FidelityTable, adjacency, target) -> tuple:
+    '''
+    Best shortest path of every node to target, from one BFS and a dynamic
+    program over the shortest-path DAG taken in order of distance.
+
+    Returns (labels, next_hops). labels[u] is the highest product of
+    repeater factors over the shortest paths from u to target (1 at target,
+    0 where unreachable), and next_hops[u] the neighbour that path goes
+    through (-1 at target and where unreachable). Factors must lie in
+    [0, 1] (table.monotone). Ties go to the first neighbour in adjacency.
+    '''
+    factors = table.factors.tolist()
+    n = len(adjacency)
+    distances = [-1] * n
+    distances[target] = 0
+    labels = [0.0] * n
+    labels[target] = 1.0
+    next_hops = [-1] * n
+    frontier = [target]
+    while frontier:
+        next_frontier = []
+        for u in frontier:
+            for v in adjacency[u]:
+                if distances[v] < 0:
+                    distances[v] = distances[u] + 1
+                    next_frontier.append(v)
+        for v in next_frontier:
+            closer = distances[v] - 1
+            best = -1.0
+            for w in adjacency[v]:
+                if distances[w] == closer:
+                    label = labels[w] if w == target else factors[w]*labels[w]
+                    if label > best + TIE_TOLERANCE:
+                        best = label
+                        next_hops[v] = w
+            labels[v] = best
+        frontier = next_frontier
+    return (labels, next_hops)
+
+
+def cost_path_labels(table: FidelityTable, adjacency, weights, distances, target) -> tuple:
+    '''
+    shortest_path_labels for least-cost paths, where a hop into node v
+    costs weights[v] > 0 and distances[u] is the least cost from u to
+    target. A neighbour w continues a least-cost path from v when
+    distances[v] = weights[w] + distances[w], up to rounding.
+    '''
+    factors = table.factors.tolist()
+    n = len(adjacency)
+    labels = [0.0] * n
+    labels[target] = 1.0
+    next_hops = [-1] * n
+    for v in sorted(range(n), key=distances.__getitem__):
+        if v == target or distances[v] == math.inf:
+            continue
+        tolerance = 1e-12 * distances[v]
+        best = -1.0
+        for w in adjacency[v]:
+            if abs(weights[w] + distances[w] - distances[v]) <= tolerance:
+                label = labels[w] if w == target else factors[w]*labels[w]
+                if label > best + TIE_TOLERANCE:
+                    best = label
+                    next_hops[v] = w
+        labels[v] = best
+    return (labels, next_hops)
+
+
+def _walk_back(parents, node) -> list:
+    path = [node]
+    while parents[node] is not None:
+        node = parents[node]
+        path.append(node)
+    return path[::-1]
+
+
+def max_fidelity_path(table: FidelityTable, adjacency, source, target, max_hops=None, distances=None):
+    '''
+    Highest fidelity path from source to target with at most max_hops hops,
+    or None if it does not pass FIDELITY_THRESHOLD.
+
+    A path's fidelity grows with the sum of log(factor) over its repeaters,
+    so this is a shortest path under the node weights -log(factor), the
+    destination excluded: Dijkstra without a hop limit, a hop-layered
+    Bellman-Ford with one. Factors must lie in [0, 1] (table.monotone).
+    With a hop limit, equally good paths with fewer hops win.
+    '''
+    log_factors = table.log_factors
+    if source == target:
+        return None
+    if max_hops is None:
+        scores = {source: 0.0}
+        parents = {source: None}
+        heap = [(0.0, 0, source)]
+        done = set()
+        order = 0
+        while heap:
+            (cost, _, u) = heapq.heappop(heap)
+            if u in done:
+                continue
+            done.add(u)
+            if u == target:
+                break
+            gain = 0.0 if u == source else log_factors[u]
+            if gain == -math.inf:
+                continue
+            for v in adjacency[u]:
+                score = scores[u] + gain
+                if v not in done and (v not in scores or score > scores[v]):
+                    scores[v] = score
+                    parents[v] = u
+                    order += 1
+                    heapq.heappush(heap, (-score, order, v))
+        if target not in done or scores[target] <= LOG_THRESHOLD:
+            return None
+        return _walk_back(parents, target)
+
+    # layer h holds the best walk of exactly h hops to each node, kept only
+    # if it beats every walk with fewer hops to that node
+    best = {source: 0.0}
+    layers = [{source: None}]
+    frontier = {source: 0.0}
+    found = None
+    for hops in range(1, max_hops + 1):
+        parents = {}
+        scores = {}
+        for (u, score) in frontier.items():
+            gain = 0.0 if u == source else log_factors[u]
+            if gain == -math.inf:
+                continue
+            for v in adjacency[u]:
+                if v == source:
+                    continue
+                if distances is not None and (distances[v] < 0 or hops + distances[v] > max_hops):
+                    continue
+                if v not in scores or score + gain > scores[v]:
+                    scores[v] = score + gain
+                    parents[v] = u
+        layers.append(parents)
+        if target in scores and (found is None or scores[target] > found[1]):
+            found = (hops, scores[target])
+        frontier = {}
+        for (v, score) in scores.items():
+            if v != target and (v not in best or score > best[v]):
+                best[v] = score
+                frontier[v] = score
+        if not frontier:
+            break
+    if found is None or found[1] <= LOG_THRESHOLD:
+        return None
+    (hops, _) = found
+    path = [target]
+    for h in range(hops, 0, -1):
+        path.append(layers[h][path[-1]])
+    return path[::-1]
+
+
+def completion_bounds(table: FidelityTable, adjacency, target, max_hops) -> tuple:
+    '''
+    (lowest, highest): lowest[r][v] and highest[r][v] are the least and
+    greatest sum of log(factor) over the nodes of a walk from v to target of
+    at most r hops, target excluded, and +inf/-inf when target is out of
+    reach. Every simple path is such a walk, so they bound the fidelity any
+    completion of a partial path can still reach.
+    '''
+    log_factors = table.log_factors
+    n = len(adjacency)
+    lowest = [[math.inf] * n]
+    highest = [[-math.inf] * n]
+    lowest[0][target] = 0.0
+    highest[0][target] = 0.0
+    for _ in range(max_hops):
+        (previous_low, previous_high) = (lowest[-1], highest[-1])
+        low = list(previous_low)
+        high = list(previous_high)
+        for v in range(n):
+            if v == target:
+                continue
+            log_factor = log_factors[v]
+            for w in adjacency[v]:
+                if previous_low[w] + log_factor < low[v]:
+                    low[v] = previous_low[w] + log_factor
+                if previous_high[w] + log_factor > high[v]:
+                    high[v] = previous_high[w] + log_factor
+        lowest.append(low)
+        highest.append(high)
+    return (lowest, highest)
+
+
+def min_fidelity_path(table: FidelityTable, adjacency, source, target, max_hops=None, bounds=None):
+    '''
+    Lowest fidelity path above FIDELITY_THRESHOLD from source to target with
+    at most max_hops hops, or None if no path passes.
+
+    Depth-first branch and bound over simple paths. A partial path is
+    dropped when completion_bounds shows that none of its completions can
+    pass the threshold, or none can beat the best path found so far. bounds
+    may be passed in when several sources share the target; they must reach
+    at least max_hops. Ties go to the first path found.
+    '''
+    if source == target:
+        return None
+    if max_hops is None:
+        max_hops = len(adjacency) - 1
+    if bounds is None or len(bounds[0]) <= max_hops:
+        bounds = completion_bounds(table, adjacency, target, max_hops)
+    (lowest, highest) = bounds
+    if highest[max_hops][source] == -math.inf:
+        return None
+    log_factors = table.log_factors
+    best = None
+    best_score = math.inf
+    path = [source]
+    on_path = {source}
+    scores = [0.0]
+    stack = [iter(adjacency[source])]
+    while stack:
+        child = next(stack[-1], None)
+        if child is None:
+            stack.pop()
+            on_path.discard(path.pop())
+            scores.pop()
+            continue
+        if child in on_path:
+            continue
+        u = path[-1]
+        score = scores[-1] + (0.0 if u == source else log_factors[u])
+        remaining = max_hops - len(path)
+        if score + highest[remaining][child] <= LOG_THRESHOLD or score + lowest[remaining][child] >= best_score - TIE_TOLERANCE:
+            continue
+        if child == target:
+            best = path + [child]
+            best_score = score
+            continue
+        path.append(child)
+        on_path.add(child)
+        scores.append(score)
+        stack.append(iter(adjacency[child]))
+    return best
+
+
+def qos_path(table: FidelityTable, adjacency, source, target, highest, max_hops=None, distances=None, bounds=None):
+    '''
+    The path select_path would choose among all paths of at most max_hops
+    hops: the highest fidelity one if highest, otherwise the lowest one
+    above the threshold. Nodes are integer indices into adjacency.
+    '''
+    if highest:
+        return max_fidelity_path(table, adjacency, source, target, max_hops, distances)
+    return min_fidelity_path(table, adjacency, source, target, max_hops, bounds)
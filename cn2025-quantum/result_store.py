@@ -0,0 +1,137 @@
+import json
+import sqlite3
+import time
+import numpy as np
+from metrics import RunningStats
+
+# configuration columns, in the order they are stored
+CONFIG_COLUMNS = ("generator", "n", "frac", "xi", "alpha", "reuse_topologies")
+RESULT_COLUMNS = ("mean_hp", "stddev_hp", "mean_lp", "stddev_lp")
+STATS_COLUMNS = tuple(f"{group}_{field}" for group in ("hp", "lp") for field in ("count", "mean", "m2", "min", "max"))
+COLUMNS = ("config",) + CONFIG_COLUMNS + ("trial", "seed", "strategy") + RESULT_COLUMNS + STATS_COLUMNS + ("seconds",)
+
+_SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS results (
+    config TEXT NOT NULL,
+    generator TEXT, n INTEGER, frac REAL, xi REAL, alpha REAL, reuse_topologies INTEGER,
+    trial INTEGER, seed INTEGER NOT NULL, strategy TEXT NOT NULL,
+    {", ".join(name + (" INTEGER" if name.endswith("_count") else " REAL") for name in RESULT_COLUMNS + STATS_COLUMNS)},
+    seconds REAL,
+    PRIMARY KEY (config, seed, strategy)
+)
+'''
+
+
+def config_key(config: dict) -> str:
+    '''
+    Canonical text of a trial configuration, the key its rows are stored
+    under.
+    '''
+    return json.dumps({name: config.get(name) for name in CONFIG_COLUMNS}, sort_keys=True)
+
+
+def _stats_row(stats: RunningStats) -> tuple:
+    return (stats.count, stats.mean, stats.m2, stats.min, stats.max)
+
+
+def _stats_from_row(row) -> RunningStats:
+    stats = RunningStats()
+    (count, stats.mean, stats.m2, stats.min, stats.max) = row
+    # stores written before the counts were INTEGER hold them as REAL
+    stats.count = int(count)
+    return stats
+
+
+class ResultStore:
+    '''
+    Append-only SQLite store of per-trial results, one row per configuration,
+    trial seed and strategy.
+
+    A row holds the configuration, the trial and its seed, the
+    (mean_hp, stddev_hp, mean_lp, stddev_lp) tuple, the moments of the
+    trial's high and low priority RunningStats (without histograms) and the
+    strategy's wall time. A seed fixes every draw of its trial, so a stored
+    (configuration, seed) cell never has to be run again: completed() lists
+    them for run_experiment to skip on restart.
+
+    Rows are buffered and written batch_size at a time, or once flush_seconds
+    have passed since the last write, in one transaction each. The database
+    runs in WAL mode with synchronous=NORMAL, so a write is one append to the
+    log without an fsync. A crash loses at most the unwritten batch, and those
+    trials run again on the next start.
+    '''
+    def __init__(self, path: str, batch_size=64, flush_seconds=10.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(_SCHEMA)
+        self.connection.commit()
+        self.pending = []
+        self.last_flush = time.monotonic()
+
+    def add(self, config: dict, trial: int, seed: int, results: dict, stats: dict, seconds=None):
+        '''
+        Queues the rows of one trial: results and stats as returned by
+        experiment.run_trial, seconds the per-strategy wall times.
+        '''
+        key = config_key(config)
+        values = tuple(config.get(name) for name in CONFIG_COLUMNS)
+        for (name, result) in results.items():
+            (hp, lp) = stats[name]
+            self.pending.append((key,) + values + (trial, seed, name) + tuple(result)
+                                + _stats_row(hp) + _stats_row(lp) + ((seconds or {}).get(name),))
+        if len(self.pending) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            with self.connection:
+                self.connection.executemany(f"INSERT OR REPLACE INTO results VALUES ({', '.join('?' * len(COLUMNS))})", self.pending)
+            self.pending = []
+        self.last_flush = time.monotonic()
+
+    def completed(self, config: dict, strategies) -> dict:
+        '''
+        The stored trials of config that have rows for every strategy:
+        {seed: (trial, results, stats, seconds)}, laid out as run_trial
+        returns them.
+        '''
+        self.flush()
+        strategies = list(strategies)
+        cursor = self.connection.execute(
+            f"SELECT trial, seed, strategy, {', '.join(RESULT_COLUMNS + STATS_COLUMNS)}, seconds FROM results "
+            f"WHERE config = ? AND strategy IN ({', '.join('?' * len(strategies))})",
+            [config_key(config)] + strategies)
+        trials = {}
+        for row in cursor:
+            (trial, seed, name) = row[:3]
+            (_, results, stats, seconds) = trials.setdefault(seed, (trial, {}, {}, {}))
+            results[name] = tuple(row[3:7])
+            stats[name] = (_stats_from_row(row[7:12]), _stats_from_row(row[12:17]))
+            seconds[name] = row[17]
+        return {seed: trial for (seed, trial) in trials.items() if len(trial[1]) == len(strategies)}
+
+    def columns(self, **where) -> dict:
+        '''
+        Every stored row matching the column values in where, as a dict of
+        column name to numpy array.
+        '''
+        self.flush()
+        clause = " AND ".join(f"{name} = ?" for name in where)
+        cursor = self.connection.execute("SELECT * FROM results" + (" WHERE " + clause if clause else ""), list(where.values()))
+        rows = cursor.fetchall()
+        return {name: np.array([row[i] for row in rows]) for (i, name) in enumerate(COLUMNS)}
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
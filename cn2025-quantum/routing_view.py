@@ -0,0 +1,156 @@
+from sequence.topology.router_net_topo import RouterNetTopo
+import hashlib
+from itertools import chain
+from networkx import Graph
+import numpy as np
+from fidelity import FidelityTable
+from forwarding import NextHops
+from compact_topology import CompactTopology
+import instrumentation
+
+# memory parameters installed by network_generator.set_parameters
+DEFAULT_FIDELITY = 0.975
+DEFAULT_EFFICIENCY = 1
+
+
+class RoutingView:
+    '''
+    Router level view of a RouterNetTopo, shared by the gen_tables_* functions.
+
+    The view holds the router graph (BSM nodes collapsed into weighted
+    router-to-router edges) with the raw fidelity and efficiency of every
+    router's memories stored as node attributes. The edges never change after
+    the topology is built, so only the node attributes are re-read when the
+    memory parameters are marked stale.
+
+    router_by_name and memory_by_name index every QuantumRouter and its
+    MemoryArray by router name, so that path walks and forwarding-table
+    writes do not have to scan the router list. names and index map routers
+    to the integer ids used by fidelity_table, and adjacency lists the
+    neighbours of every router by id.
+
+    next_hops is the forwarding state the routing strategies write and the
+    metrics walk: a forwarding.NextHops over router ids, next_hops[u, t]
+    the next hop of router u towards t, with a column only for the
+    destinations that have rules.
+    It starts from the routers' SeQUeNCe tables, read when first used.
+    After that it is the reference, and push_forwarding_tables in
+    network_generator copies it back to SeQUeNCe.
+
+    A view can also be built from a CompactTopology. It then has no routers
+    to read parameters from or push rules to: its parameters start at the
+    set_parameters defaults and are changed with set_node_params, and its
+    next_hops start empty.
+    '''
+    def __init__(self, topology):
+        self.router_by_name = {}
+        self.memory_by_name = {}
+        self.graph = Graph()
+        if isinstance(topology, CompactTopology):
+            self.routers = []
+            self.names = list(topology.names)
+            self.graph.add_nodes_from(self.names)
+            self.graph.add_weighted_edges_from(zip([self.names[u] for u in topology.u.tolist()],
+                                                   [self.names[v] for v in topology.v.tolist()],
+                                                   topology.router_distances().tolist()))
+            self.fidelity = np.full(len(self.names), DEFAULT_FIDELITY, dtype=float)
+            self.efficiency = np.full(len(self.names), DEFAULT_EFFICIENCY, dtype=float)
+        else:
+            self.routers = topology.get_nodes_by_type(RouterNetTopo.QUANTUM_ROUTER)
+            self.names = [node.name for node in self.routers]
+            for node in self.routers:
+                self.router_by_name[node.name] = node
+                self.memory_by_name[node.name] = node.get_components_by_type("MemoryArray")[0]
+                self.graph.add_node(node.name)
+            instrumentation.count("get_components_by_type", len(self.routers))
+            costs = {}
+            for qc in topology.qchannels:
+                router, bsm = qc.sender.name, qc.receiver
+                if bsm not in costs:
+                    costs[bsm] = [router, qc.distance]
+                else:
+                    costs[bsm] = [router] + costs[bsm]
+                    costs[bsm][-1] += qc.distance
+            self.graph.add_weighted_edges_from(costs.values())
+        self.index = {name: i for (i, name) in enumerate(self.names)}
+        self.adjacency = [[self.index[neighbour] for neighbour in self.graph[name]] for name in self.names]
+        instrumentation.count("graphs_built")
+        self._structure_key = None
+        self._next_hops = None
+        self.stale = True
+        self.refresh()
+
+    def refresh(self):
+        if self.routers:
+            self.fidelity = np.empty(len(self.names))
+            self.efficiency = np.empty(len(self.names))
+            for (i, name) in enumerate(self.names):
+                memory = self.memory_by_name[name][0]
+                self.fidelity[i] = memory.raw_fidelity
+                self.efficiency[i] = memory.efficiency
+        for (i, name) in enumerate(self.names):
+            attributes = self.graph.nodes[name]
+            attributes["fidelity"] = float(self.fidelity[i])
+            attributes["efficiency"] = float(self.efficiency[i])
+        self.fidelity_table = FidelityTable.from_params(self.efficiency, self.fidelity)
+        self.stale = False
+
+    def set_node_params(self, efficiency=None, fidelity=None):
+        if efficiency is not None:
+            self.efficiency = np.array(efficiency, dtype=float)
+        if fidelity is not None:
+            self.fidelity = np.array(fidelity, dtype=float)
+        self.stale = True
+
+    def structure_key(self) -> str:
+        '''
+        Hash of the router graph by id: the router count and the neighbours
+        of every router in adjacency order. Names, and so the "hd" labels,
+        are left out.
+        '''
+        if self._structure_key is None:
+            counts = [len(self.names)] + [len(neighbours) for neighbours in self.adjacency]
+            ids = np.fromiter(chain(counts, chain.from_iterable(self.adjacency)), dtype=np.int64)
+            self._structure_key = hashlib.sha1(ids.tobytes()).hexdigest()
+        return self._structure_key
+
+    def routing_protocol(self, name: str):
+        # routing protocol locates at the bottom of the stack
+        return self.router_by_name[name].network_manager.protocol_stack[0]
+
+    @property
+    def next_hops(self) -> NextHops:
+        if self._next_hops is None:
+            self._next_hops = NextHops(len(self.names))
+            for (u, name) in enumerate(self.names if self.routers else []):
+                for (destination, next_hop) in self.routing_protocol(name).forwarding_table.items():
+                    if destination in self.index and next_hop in self.index:
+                        self._next_hops[u, self.index[destination]] = self.index[next_hop]
+        return self._next_hops
+
+    @next_hops.setter
+    def next_hops(self, next_hops: NextHops):
+        self._next_hops = next_hops
+
+    def clear_next_hops(self):
+        self._next_hops = NextHops(len(self.names))
+
+    def path_indices(self, path) -> list:
+        return [self.index[name] for name in path]
+
+
+def get_routing_view(topology, view: RoutingView = None) -> RoutingView:
+    if view is None:
+        view = getattr(topology, "routing_view", None)
+    if view is None:
+        view = RoutingView(topology)
+        topology.routing_view = view
+    elif view.stale:
+        view.refresh()
+    return view
+
+
+def invalidate_routing_view(topology):
+    view = getattr(topology, "routing_view", None)
+    if view is not None:
+        view.stale = True
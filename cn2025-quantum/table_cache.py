@@ -0,0 +1,142 @@
+import hashlib
+import json
+import sqlite3
+import numpy as np
+import forwarding
+import instrumentation
+
+def table_key(view, strategy: str, pairs=None, is_high=None) -> str:
+    '''
+    Hash of everything the forwarding tables of a strategy depend on: the
+    router names and structure of view, its memory efficiencies and
+    fidelities, and strategy, a text naming the strategy and its k/x
+    arguments. The per-pair strategies also depend on the (source,
+    destination) pairs they route and, through is_high, on which of the
+    destinations are high priority.
+    '''
+    digest = hashlib.sha1()
+    digest.update(json.dumps([strategy, view.names, view.structure_key()]).encode())
+    digest.update(np.ascontiguousarray(view.efficiency, dtype=float).tobytes())
+    digest.update(np.ascontiguousarray(view.fidelity, dtype=float).tobytes())
+    if pairs is not None:
+        labels = [is_high is not None and bool(is_high(destination)) for (_, destination) in pairs]
+        digest.update(json.dumps([pairs, labels]).encode())
+    return digest.hexdigest()
+
+
+class TableCache:
+    '''
+    On-disk cache of computed forwarding tables, in one SQLite file.
+
+    An entry holds every rule of the view's next_hops as an int32 (router,
+    destination, next hop) array of router ids. A per-pair strategy's entry
+    also holds its chosen paths: the pair ids, the path lengths (0 for no
+    path) and the paths concatenated. On a hit, install() writes the rules
+    into next_hops with one scatter per destination and rebuilds
+    final_paths, so routing is skipped.
+
+    Pass it as table_cache to evaluate_strategies, whose strategies look
+    up and fill it through routed(). New entries are written batch_size at
+    a time and on flush() or close(); as a context manager it is closed on
+    exit, like a ResultStore. hits and misses count lookups.
+    '''
+    def __init__(self, path: str, batch_size=16):
+        self.path = path
+        self.batch_size = batch_size
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS tables (key TEXT PRIMARY KEY, rules BLOB, pairs BLOB, lengths BLOB, paths BLOB)")
+        self.connection.commit()
+        self.pending = []
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        self.flush()
+        row = self.connection.execute("SELECT rules, pairs, lengths, paths FROM tables WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            instrumentation.count("table_cache_misses")
+            return None
+        self.hits += 1
+        instrumentation.count("table_cache_hits")
+        return tuple(None if blob is None else np.frombuffer(blob, dtype=np.int32) for blob in row)
+
+    def put(self, key: str, view, final_paths=None):
+        '''
+        Queues the next_hops of view, and the final_paths a per-pair
+        strategy returned, under key.
+        '''
+        index = view.index
+        row = [key, forwarding.rules(view.next_hops).tobytes(), None, None, None]
+        if final_paths is not None:
+            pairs = [(index[source], index[destination]) for (source, destination) in final_paths]
+            paths = [path or [] for path in final_paths.values()]
+            row[2] = np.array(pairs, dtype=np.int32).tobytes()
+            row[3] = np.array([len(path) for path in paths], dtype=np.int32).tobytes()
+            row[4] = np.array([index[name] for path in paths for name in path], dtype=np.int32).tobytes()
+        self.pending.append(tuple(row))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def install(self, view, entry):
+        '''
+        Replaces view.next_hops with the cached rules of entry and returns
+        the cached final_paths, or None for a table strategy.
+        '''
+        (rules, pairs, lengths, paths) = entry
+        names = view.names
+        rules = rules.reshape(-1, 3)
+        view.clear_next_hops()
+        next_hops = view.next_hops
+        # rules come grouped by destination, one scatter per column
+        (targets, starts) = np.unique(rules[:, 1], return_index=True)
+        for (target, block) in zip(targets.tolist(), np.split(rules, starts[1:])):
+            next_hops.column(target)[block[:, 0]] = block[:, 2]
+        instrumentation.count("forwarding_rules", len(rules))
+        if pairs is None:
+            return None
+        final_paths = {}
+        ids = paths.tolist()
+        start = 0
+        for ((source, destination), length) in zip(pairs.reshape(-1, 2).tolist(), lengths.tolist()):
+            final_paths[(names[source], names[destination])] = [names[i] for i in ids[start:start + length]] if length else None
+            start += length
+        return final_paths
+
+    def flush(self):
+        if self.pending:
+            with self.connection:
+                self.connection.executemany("INSERT OR REPLACE INTO tables VALUES (?, ?, ?, ?, ?)", self.pending)
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def routed(cache, view, strategy: str, compute, pairs=None, is_high=None):
+    '''
+    Calls compute(), which writes the next_hops of view and returns
+    the strategy's final_paths (None for a table strategy), and stores the
+    outcome in cache, a TableCache or None. When the cache already holds
+    it, the tables are installed from there instead and compute is never
+    called.
+    '''
+    if cache is None:
+        return compute()
+    key = table_key(view, strategy, pairs, is_high)
+    entry = cache.get(key)
+    if entry is not None:
+        return cache.install(view, entry)
+    final_paths = compute()
+    cache.put(key, view, final_paths)
+    return final_paths
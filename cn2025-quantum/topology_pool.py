@@ -0,0 +1,76 @@
+from collections import OrderedDict
+import random
+from sequence.topology.router_net_topo import RouterNetTopo
+from graph_builder import regular_gen, waxman_gen, regular_gen_compact, waxman_gen_compact
+from network_generator import dict_to_topo, set_parameters, clear_forwarding_tables
+
+GENERATORS = {
+    "regular": regular_gen,
+    "waxman": waxman_gen,
+}
+# the same generators, returning CompactTopology for the analytic backend
+COMPACT_GENERATORS = {
+    "regular": regular_gen_compact,
+    "waxman": waxman_gen_compact,
+}
+# generators that give the same structure on every call
+FIXED_STRUCTURE_GENERATORS = ("regular",)
+
+
+class Trial:
+    '''
+    One trial handed out by a TopologyPool.
+
+    The template topology names every destination "d<i>", so the high
+    quality destinations of the trial are given by is_high, which replaces
+    graph_builder.is_high in the evaluate_* and gen_tables_*_qos calls.
+    '''
+    def __init__(self, topology: RouterNetTopo, high_quality):
+        self.topology = topology
+        self.high_quality = set(high_quality)
+        self.high_names = {"d"+str(i) for i in self.high_quality}
+
+    def is_high(self, string: str) -> bool:
+        return string in self.high_names
+
+
+class TopologyPool:
+    '''
+    Builds every structural topology once and reuses it across trials.
+
+    Templates are keyed by generator, n and the generator's structural
+    parameters (frac only decides the destination labels, so it is not part
+    of the key). Handing out a trial resets the template's memory, detector
+    and channel parameters with set_parameters, clears its forwarding tables
+    and draws a fresh set of high quality destinations, the same way
+    regular_gen/waxman_gen draw them. The SeQUeNCe objects themselves are
+    never rebuilt, so a trial is only valid until the next acquire on the
+    same template.
+
+    waxman_gen draws its structure at random, so a waxman template is one
+    fixed draw per key. Pass a different structure key to hold several;
+    run_trial, whose trials each need a fresh draw, only pools the
+    FIXED_STRUCTURE_GENERATORS.
+    At most max_templates templates are kept, least recently used first out.
+    '''
+    def __init__(self, max_templates=4):
+        self.max_templates = max_templates
+        self.templates = OrderedDict()
+
+    def template(self, generator="regular", n=6, structure=None, **params) -> RouterNetTopo:
+        key = (generator, n, structure, tuple(sorted(params.items())))
+        if key in self.templates:
+            self.templates.move_to_end(key)
+            return self.templates[key]
+        topology = dict_to_topo(GENERATORS[generator](n, frac=0, **params))
+        self.templates[key] = topology
+        while len(self.templates) > self.max_templates:
+            self.templates.popitem(last=False)
+        return topology
+
+    def acquire(self, generator="regular", n=6, frac=0.3, structure=None, **params) -> Trial:
+        topology = self.template(generator, n, structure, **params)
+        set_parameters(topology)
+        clear_forwarding_tables(topology)
+        high_quality = random.sample(range(1, n+1), round(n*frac))
+        return Trial(topology, high_quality)